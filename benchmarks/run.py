@@ -0,0 +1,162 @@
+"""
+throughput benchmarks for the annotation, parsing and upload hot paths
+
+    python benchmarks/run.py --size 100000
+    python benchmarks/run.py --size 20000 --only load_annotations --latency 0.01
+    python benchmarks/run.py --only load_annotations --cassette dataverse.sqlite --record
+    python benchmarks/run.py --only load_annotations --cassette dataverse.sqlite --latency 0.2 --failure-rate 0.05
+
+each line reports the stage, how many documents it handled, the time taken,
+documents per second and the process's peak RSS so far
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+import resource
+import tempfile
+import importlib.util
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import synthetic
+
+from outbreak_parser_tools          import addendum, cassette, safe_request
+from outbreak_parser_tools.logger   import metrics
+from outbreak_parser_tools.parallel import transform_records
+
+PARSER_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests', 'parser_files', 'parser.py')
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / 1024
+
+def report(stage, count, seconds):
+    rate = count / seconds if seconds else float('inf')
+    print(f'{stage:<48} {count:>10} docs {seconds:>9.3f}s {rate:>12,.0f} docs/s {peak_rss_mb():>9.1f} MB peak')
+    sys.stdout.flush()
+
+def timed(stage, count, func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    report(stage, count, time.perf_counter() - start)
+    return result
+
+def load_parser():
+    spec = importlib.util.spec_from_file_location('dataverse_parser', PARSER_FILE)
+    parser = importlib.util.module_from_spec(spec)
+    # registered so forked transform workers can unpickle its functions
+    sys.modules[spec.name] = parser
+    spec.loader.exec_module(parser)
+    return parser
+
+def bench_annotations(size, directory, backends, ndjson):
+    files = timed('write annotation files', size, synthetic.write_annotation_files, directory, size, ndjson)
+    documents = list(synthetic.make_documents(size))
+    classes = {'corrections': addendum.Correction, 'topics': addendum.Topic, 'altmetrics': addendum.Metric}
+
+    for backend in backends:
+        annotators = {name: classes[name](files[name], backend=backend) for name in classes}
+        # constructing an annotator does no I/O, loading (or indexing) the file happens here
+        for name, annotator in annotators.items():
+            timed(f'[{backend}] open {name}', size, annotator.load)
+
+        for name, annotator in annotators.items():
+            timed(f'[{backend}] {name} relevant_annotation_dict', size, annotator.relevant_annotation_dict, documents)
+
+        batch = [dict(d) for d in documents]
+        for name, annotator in annotators.items():
+            timed(f'[{backend}] {name} update', size, annotator.update, batch)
+
+        composite = addendum.CompositeAnnotation(annotators)
+        timed(f'[{backend}] composite update', size, composite.update, [dict(d) for d in documents])
+
+        stream = addendum.CompositeAnnotation(annotators).stream(synthetic.make_documents(size))
+        timed(f'[{backend}] composite stream', size, lambda: sum(1 for _ in stream))
+
+    external = addendum.CompositeAnnotation({name: classes[name](files[name], backend='external') for name in classes})
+    joined = external.join(synthetic.make_documents(size), directory=directory)
+    timed('[external] composite join', size, lambda: sum(1 for _ in joined))
+
+def bench_transform(size, processes):
+    parser  = load_parser()
+    schemas = [(synthetic.global_id(i), synthetic.make_schema(synthetic.global_id(i))) for i in range(size)]
+    timed('transform_schema', size, lambda: [parser.transform_schema(schema, gid) for gid, schema in schemas])
+    timed(f'transform_records ({processes} processes, ordered)', size,
+          lambda: sum(1 for _ in transform_records(schemas, parser.transform_schema, processes=processes, ordered=True)))
+
+def bench_load_annotations(size, latency):
+    parser = load_parser()
+    server = synthetic.serve_dataverse(size, latency=latency)
+    parser.DATAVERSE_SERVER = server.api
+    parser.EXPORT_URL = f'{server.api}datasets/export?exporter=schema.org'
+    parser.QUERIES = ['COVID-19']
+    try:
+        count = timed('load_annotations (stub server)', size, lambda: sum(1 for _ in parser.load_annotations()))
+        print(f'{"":<48} {server.requests} requests, {server.bytes_sent / (1 << 20):.1f} MB served')
+    finally:
+        server.shutdown()
+        server.server_close()
+    if count != size:
+        print(f'load_annotations yielded {count} of {size} documents')
+
+def bench_cassette(path, record, latency, failure_rate, seed):
+    """
+    load_annotations against the live Dataverse API, recording every response
+    into the cassette at path, or replayed from it without the network.
+    a replay only finds the pages it was recorded with, so injected failures are
+    503s, which the paginator waits out rather than answering with smaller pages
+    """
+    parser = load_parser()
+    if record:
+        cassette.record(path)
+        stage = 'load_annotations (recording live API)'
+    else:
+        cassette.replay(path, latency=latency, failure_rate=failure_rate, seed=seed)
+        stage = f'load_annotations (replay, {latency}s, {failure_rate:.0%} failing)'
+    try:
+        start = time.perf_counter()
+        count = sum(1 for _ in parser.load_annotations())
+        report(stage, count, time.perf_counter() - start)
+    finally:
+        safe_request.configure()
+
+STAGES = ('annotations', 'transform', 'load_annotations')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=10000, help='documents in the synthetic corpus')
+    parser.add_argument('--only', choices=STAGES, action='append', help='run only these stages')
+    parser.add_argument('--backends', default='memory,index,snapshot', help='annotation backends to compare')
+    parser.add_argument('--ndjson', action='store_true', help='write the annotation files as NDJSON')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds the stub server (or a replay) waits per request')
+    parser.add_argument('--cassette', help='run load_annotations against this recorded cassette instead of the stub server')
+    parser.add_argument('--record', action='store_true', help='record the live Dataverse API into --cassette')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='share of replayed requests answered with a 503')
+    parser.add_argument('--seed', type=int, default=0, help='seed for the replay\'s injected latency and failures')
+    parser.add_argument('--processes', type=int, default=os.cpu_count(), help='worker processes for the parallel transform')
+    parser.add_argument('--summary', help='write the run\'s per-stage metrics summary here as JSON')
+    args = parser.parse_args()
+    summary = args.summary and os.path.abspath(args.summary)
+    cassette_file = args.cassette and os.path.abspath(args.cassette)
+
+    logging.disable(logging.WARNING)
+    stages = args.only or STAGES
+    with tempfile.TemporaryDirectory() as directory:
+        # keep the parser's log file out of the working tree
+        os.chdir(directory)
+        if 'annotations' in stages:
+            bench_annotations(args.size, directory, args.backends.split(','), args.ndjson)
+        if 'transform' in stages:
+            bench_transform(args.size, args.processes)
+        if 'load_annotations' in stages and cassette_file:
+            bench_cassette(cassette_file, args.record, args.latency, args.failure_rate, args.seed)
+        elif 'load_annotations' in stages:
+            bench_load_annotations(args.size, args.latency)
+    if summary:
+        metrics.write_summary(summary)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+"""
+synthetic corpora for the benchmarks: documents, the annotation files Addendum
+reads, and a local Dataverse-like server with paginated search and schema.org exports
+"""
+import json
+import time
+import random
+import threading
+
+from http.server  import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from outbreak_parser_tools import serialization
+
+TOPICS = ['Mechanism', 'Transmission', 'Treatment', 'Prevention', 'Forecasting', 'Diagnosis', 'Case Report', 'Epidemic Forecasting']
+
+def document_id(i):
+    return f'2020.{i // 100000:02d}.{i % 100000:05d}'
+
+def make_documents(size, seed=0):
+    rng = random.Random(seed)
+    for i in range(size):
+        document = {
+            "@context": {"outbreak": "https://discovery.biothings.io/view/outbreak/", "schema": "http://schema.org/"},
+            "@type": "Publication",
+            "_id": document_id(i),
+            "name": f"synthetic publication {i}",
+            "abstract": " ".join(rng.choice(TOPICS).lower() for _ in range(40)),
+            "author": [{"@type": "Person", "name": f"Author {rng.randrange(size)}"} for _ in range(rng.randint(1, 6))],
+        }
+        if rng.random() < 0.2:
+            document['evaluations'] = [{"@type": "Rating", "name": "citations", "ratingValue": rng.randint(0, 500)}]
+        yield document
+
+def make_topics(size, coverage=0.8, seed=1):
+    rng = random.Random(seed)
+    for i in range(size):
+        if rng.random() < coverage:
+            categories = rng.sample(TOPICS, rng.randint(1, 3))
+            yield {"_id": document_id(i), "topicCategory": str(categories)}
+
+def make_altmetrics(size, coverage=0.5, seed=2):
+    rng = random.Random(seed)
+    for i in range(size):
+        if rng.random() < coverage:
+            yield {"_id": document_id(i), "evaluations": [{
+                "@type": "Rating", "name": "altmetric", "ratingValue": round(rng.random() * 100, 2),
+                "ratingExplanation": "score from altmetric.com", "reviewAspect": "Altmetric score",
+                "url": f"https://altmetric.com/details/{i}",
+            }]}
+
+def make_corrections(size, coverage=0.05, seed=3):
+    rng = random.Random(seed)
+    for i in range(size):
+        if rng.random() < coverage:
+            yield {"_id": document_id(i), "correction": [{
+                "@type": "Correction", "identifier": f"10.1101/{document_id(i)}", "correctionType": "preprint of",
+                "url": f"https://doi.org/10.1101/{document_id(i)}",
+            }]}
+
+def write_annotation_files(directory, size, ndjson=False):
+    """
+    writes topics, altmetrics and corrections files for a corpus of size documents
+    returns {name: path}
+    """
+    write = serialization.write_ndjson if ndjson else serialization.write_json_array
+    extension = 'ndjson' if ndjson else 'json'
+    files = {}
+    for name, records in (('topics', make_topics(size)), ('altmetrics', make_altmetrics(size)), ('corrections', make_corrections(size))):
+        files[name] = f'{directory}/{name}.{extension}'
+        write(records, files[name])
+    return files
+
+def global_id(i):
+    return f'doi:10.7910/DVN/S{i:07d}'
+
+def make_search_item(i):
+    return {
+        "name": f"synthetic dataset {i}",
+        "type": "dataset",
+        "url": f"https://doi.org/10.7910/DVN/S{i:07d}",
+        "global_id": global_id(i),
+        "published_at": "2021-03-01T00:00:00Z",
+        "updatedAt": "2021-03-02T00:00:00Z",
+    }
+
+def make_schema(gid, seed=None):
+    rng = random.Random(seed if seed is not None else gid)
+    return {
+        "@context": "http://schema.org",
+        "@type": "Dataset",
+        "@id": f"https://doi.org/{gid.replace('doi:', '')}",
+        "identifier": f"https://doi.org/{gid.replace('doi:', '')}",
+        "name": f"dataset {gid}",
+        "creator": [{"name": f"Creator {rng.randrange(1000)}", "affiliation": "Scripps Research"} for _ in range(rng.randint(1, 4))],
+        "author":  [{"name": f"Author {rng.randrange(1000)}", "affiliation": "Scripps Research"} for _ in range(rng.randint(1, 8))],
+        "datePublished": "2021-03-01",
+        "dateModified": "2021-03-02",
+        "version": "1",
+        "description": [" ".join(rng.choice(TOPICS).lower() for _ in range(60))],
+        "keywords": rng.sample(TOPICS, 3),
+        "license": {"@type": "Dataset", "url": "http://creativecommons.org/publicdomain/zero/1.0"},
+        "provider": {"@type": "Organization", "name": "Harvard Dataverse"},
+        "distribution": [{"@type": "DataDownload", "name": f"file{j}.csv", "fileFormat": "text/csv",
+                          "contentSize": rng.randrange(10 ** 6)} for j in range(rng.randint(0, 5))],
+    }
+
+class StubDataverse(BaseHTTPRequestHandler):
+    """
+    /api/search pages through server.items (type=dataverse lists server.dataverses),
+    /api/datasets/export returns a generated schema.org record
+    """
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        url   = urlparse(self.path)
+        query = parse_qs(url.query)
+
+        if url.path.endswith('/search'):
+            start    = int(query.get('start', ['0'])[0])
+            per_page = int(query.get('per_page', ['10'])[0])
+            items = self.server.dataverses if query.get('type') == ['dataverse'] else self.server.items
+            body = {"status": "OK", "data": {"total_count": len(items), "items": items[start:start + per_page]}}
+        elif url.path.endswith('/datasets/export'):
+            body = make_schema(query['persistentId'][0])
+        else:
+            self.send_error(404)
+            return
+
+        payload = json.dumps(body).encode()
+        with self.server.lock:
+            self.server.requests += 1
+            self.server.bytes_sent += len(payload)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+def serve_dataverse(size, latency=0.0):
+    """
+    starts a StubDataverse over size datasets on a local port in a daemon thread
+    returns the server; its api root is server.api, stop it with server.shutdown()
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubDataverse)
+    server.daemon_threads = True
+    server.items      = [make_search_item(i) for i in range(size)]
+    server.dataverses = [{"identifier": "covid19", "type": "dataverse", "name": "COVID-19"}]
+    server.latency    = latency
+    server.requests   = 0
+    server.bytes_sent = 0
+    server.lock       = threading.Lock()
+    server.api        = f'http://127.0.0.1:{server.server_port}/api/'
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
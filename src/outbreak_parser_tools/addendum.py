@@ -1,6 +1,18 @@
 import os
-import json
+import sys
+import copy
 import logging
+import threading
+
+from collections import Counter
+from functools   import lru_cache
+
+from .                 import serialization
+from .annotation_store import AnnotationStore
+from .external         import RUN_SIZE, merge_join
+from .logger           import count, timer
+from .snapshot         import AnnotationSnapshot
+from .utils            import chunked
 
 HOME_DIR = '/opt/home/outbreak'
 
@@ -12,75 +24,295 @@ ANNOTATION_PATHS = {
     'loe_annotations':  os.path.join(HOME_DIR, 'covid19_LST_annotations',   'results', 'loe_annotations.json')
 }
 
+CHUNK_SIZE = 1000
+TOPIC_CACHE_SIZE = 1 << 16
+
+# backends other than the default in-memory list and 'external',
+# which keeps nothing in memory and is meant for join()
+STORES = {
+    'index':    AnnotationStore,
+    'snapshot': AnnotationSnapshot,
+}
+
+# (class, source file, backend, store_dir) -> (pid, mtime_ns, size), None, store
+LOADED      = {}
+LOADED_LOCK = threading.Lock()
+
+def clear_loaded():
+    """
+    closes and forgets every store loaded so far
+    """
+    with LOADED_LOCK:
+        for signature, _, store in LOADED.values():
+            if store is not None and signature[0] == os.getpid():
+                store.close()
+        LOADED.clear()
+
 class Annotation:
-    def __init__(self, source_file):
+    """
+    annotations from source_file, loaded on first use: constructing one does
+    no I/O, and neither does an update() with no documents. an index or
+    snapshot is shared by every annotator of the same class, file, backend and
+    store_dir in the process until the file changes (or clear_loaded()), the
+    memory backend's list belongs to the annotator and goes with it.
+    store_dir is where the index or snapshot backend keeps its file, next to
+    source_file by default
+    """
+    def __init__(self, source_file, backend='memory', store_dir=None):
         logging.warning(f'adding {self.__class__}')
-        with open(source_file,'r') as infile:
-            self.annotations = json.load(infile)
+        if backend not in STORES and backend not in ('memory', 'external'):
+            raise ValueError(f'unknown annotation backend {backend}')
+        self.source_file = source_file
+        self.backend     = backend
+        self.store_dir   = store_dir
+        self.loaded = None
+        self.lock   = threading.Lock()
+
+    def load(self):
+        stat = os.stat(self.source_file)
+        # per process: a forked worker must not reuse its parent's connections
+        signature = (os.getpid(), stat.st_mtime_ns, stat.st_size)
+        if self.backend == 'memory':
+            with self.lock:
+                if self.loaded is None or self.loaded[0] != signature:
+                    logging.warning(f'loading {self.source_file} for {self.name}')
+                    # later duplicates win
+                    annotations = {i['_id']: self.prepare(i) for i in serialization.read_records(self.source_file)}
+                    self.loaded = (signature, annotations, None)
+                return self.loaded
+
+        key = (self.__class__, os.path.abspath(self.source_file), self.backend, self.store_dir)
+        with LOADED_LOCK:
+            loaded = LOADED.get(key)
+            if loaded is not None and loaded[0] == signature:
+                return loaded
+            if loaded is not None and loaded[2] is not None and loaded[0][0] == signature[0]:
+                loaded[2].close()
+
+            logging.warning(f'loading {self.source_file} for {self.name}')
+            store = None
+            if self.backend != 'external':
+                # index_dir or snapshot_dir, depending on the store
+                store = STORES[self.backend](self.source_file, self.prepare, self.store_dir)
+            LOADED[key] = (signature, None, store)
+            return LOADED[key]
+
+    @property
+    def annotations(self):
+        return self.load()[1]
+
+    @property
+    def store(self):
+        return self.load()[2]
 
     def relevant_annotation_dict(self, documents):
         doc_ids = set([i['_id'] for i in documents])
         logging.warning(f'{len(doc_ids)} relevant ids')
-        return {i['_id']: i for i in self.annotations if i['_id'] in doc_ids}
+        with timer(f'lookup.{self.name}'):
+            return self.lookup(doc_ids)
 
-class Correction(Annotation):
-    def update(self, documents):
-        annotations = self.relevant_annotation_dict(documents)
+    def lookup(self, doc_ids):
+        if not doc_ids:
+            return {}
+        _, annotations, store = self.load()
+        if store is not None:
+            return store.get_many(doc_ids)
+        if annotations is None:
+            return {i['_id']: i for i in self.records() if i['_id'] in doc_ids}
+        return {_id: annotations[_id] for _id in doc_ids if _id in annotations}
 
-        for document in documents:
-            correction = annotations.get(document['_id'])
-            if correction and correction.get('correction'):
-                correction = correction.get('correction')
-            else:
-                continue
-
-            if document.get('correction'):
-                # not sure this branch is used at all
-                if isinstance(document['correction'], list):
-                    document['correction'].append(correction)
-            else:
-                # document does not yet have a correction
-                document['correction'] = correction
-                #print(f'{document["_id"]} correction {document["correction"]}')
+    def records(self):
+        """
+        streams the prepared annotations from the source file
+        """
+        for record in serialization.iter_records(self.source_file):
+            yield self.prepare(record)
+
+    def prepare(self, annotation):
+        """
+        precomputes whatever apply needs from a raw annotation,
+        stores keep the prepared form so it is done once per record
+        """
+        return annotation
+
+    def apply(self, document, annotation):
+        """
+        adds an annotation to a document, copying anything mutable it hands over:
+        the memory backend gives every document with the same _id the same object
+        """
+        raise NotImplementedError
+
+    @property
+    def name(self):
+        return self.__class__.__name__.lower()
 
-class Topic(Annotation):
     def update(self, documents):
         annotations = self.relevant_annotation_dict(documents)
 
-        for document in documents:
-            topic = annotations.get(document['_id'])
-            if not topic:
-                continue
+        annotated = 0
+        with timer(f'annotate.{self.name}'):
+            for document in documents:
+                annotation = annotations.get(document['_id'])
+                if not annotation:
+                    continue
+                self.apply(document, annotation)
+                annotated += 1
+        count(f'docs_in.{self.name}', len(documents))
+        count(f'docs_annotated.{self.name}', annotated)
 
-            topicslist = topic['topicCategory'].replace("'","").strip("[").strip("]").split(",")
-            document['topicCategory'] = [x.strip(" ") for x in topicslist]
-            #print(f"{document['_id']} topic {document['topicCategory']}")
+    def stream(self, documents, chunk_size=CHUNK_SIZE):
+        """
+        annotates any iterable of documents, e.g. a parser's generator,
+        chunk_size documents at a time and yields them back as each chunk is done
+        """
+        for chunk in chunked(documents, chunk_size):
+            self.update(chunk)
+            yield from chunk
+
+    def join(self, documents, run_size=RUN_SIZE, directory=None):
+        """
+        out-of-core update for document sets or sources too big for memory:
+        both are sorted on _id through temporary runs of run_size records in
+        directory and merge-joined. yields the annotated documents in _id order
+        """
+        yield from join_annotations({self.name: self}, documents, run_size, directory)
+
+class Correction(Annotation):
+    def apply(self, document, correction):
+        if correction.get('correction'):
+            correction = correction.get('correction')
+        else:
+            return
+
+        if document.get('correction'):
+            # not sure this branch is used at all
+            if isinstance(document['correction'], list):
+                document['correction'].append(copy.deepcopy(correction))
+        else:
+            # document does not yet have a correction
+            document['correction'] = copy.deepcopy(correction)
+            #print(f'{document["_id"]} correction {document["correction"]}')
+
+@lru_cache(maxsize=TOPIC_CACHE_SIZE)
+def parse_topic_category(topic_category):
+    """
+    "['Mechanism', 'Treatment']" -> ('Mechanism', 'Treatment')
+    the same few strings repeat across the corpus, so each distinct one is
+    parsed once and the interned tuple is shared
+    """
+    topicslist = topic_category.replace("'","").strip("[").strip("]").split(",")
+    return tuple(sys.intern(x.strip(" ")) for x in topicslist)
+
+def normalise_topics(topics):
+    """
+    yields topic annotations with topicCategory parsed into a list
+    """
+    for topic in topics:
+        if isinstance(topic['topicCategory'], str):
+            topic = {**topic, 'topicCategory': list(parse_topic_category(topic['topicCategory']))}
+        yield topic
+
+def normalise_topics_file(source_file, destination):
+    """
+    rewrites a topics file with topicCategory already parsed into lists,
+    so loading it at upload time needs no string parsing at all
+    """
+    records = serialization.iter_records(source_file)
+    if destination.endswith('.ndjson'):
+        return serialization.write_ndjson(normalise_topics(records), destination)
+    return serialization.write_json_array(normalise_topics(records), destination)
+
+class Topic(Annotation):
+    def prepare(self, topic):
+        if isinstance(topic['topicCategory'], str):
+            topic = {**topic, 'topicCategory': parse_topic_category(topic['topicCategory'])}
+        return topic
+
+    def apply(self, document, topic):
+        document['topicCategory'] = list(self.prepare(topic)['topicCategory'])
+        #print(f"{document['_id']} topic {document['topicCategory']}")
 
 class Metric(Annotation):
+    def apply(self, document, alt_metric):
+        if document.get('evaluations'):
+            try:
+                document['evaluations'].append(copy.deepcopy(alt_metric['evaluations'][0]))
+            except:
+                eval_object = document['evaluations']
+                document['evaluations']=[eval_object,copy.deepcopy(alt_metric['evaluations'][0])]
+        else:
+            document['evaluations'] = copy.deepcopy(alt_metric['evaluations'])
+            #print(f'{document["_id"]} evaluation {document["evaluations"]}')
+
+class CompositeAnnotation:
+    """
+    joins several annotators on _id and applies all of them in a single
+    pass over the documents, counting hits per source in self.hits
+    """
+    def __init__(self, annotators):
+        logging.warning(f'adding {self.__class__} of {", ".join(annotators)}')
+        self.annotators = dict(annotators)
+        self.hits = Counter()
+
     def update(self, documents):
-        annotations = self.relevant_annotation_dict(documents)
+        doc_ids = set([i['_id'] for i in documents])
+        logging.warning(f'{len(doc_ids)} relevant ids')
+        sources = []
+        for name, annotator in self.annotators.items():
+            with timer(f'lookup.{name}'):
+                sources.append((name, annotator, annotator.lookup(doc_ids)))
+
+        hits = Counter()
+        with timer('annotate.composite'):
+            for document in documents:
+                for name, annotator, annotations in sources:
+                    annotation = annotations.get(document['_id'])
+                    if not annotation:
+                        continue
+                    annotator.apply(document, annotation)
+                    hits[name] += 1
+
+        self.hits.update(hits)
+        count('docs_in.composite', len(documents))
+        for name, annotated in hits.items():
+            count(f'docs_annotated.{name}', annotated)
+
+    stream = Annotation.stream
+
+    def join(self, documents, run_size=RUN_SIZE, directory=None):
+        """
+        out-of-core update() against every source at once, see Annotation.join
+        """
+        yield from join_annotations(self.annotators, documents, run_size, directory, self.hits)
+
+def join_annotations(annotators, documents, run_size=RUN_SIZE, directory=None, total_hits=None):
+    sources = [(name, annotator.apply, annotator.records()) for name, annotator in annotators.items()]
+    hits = Counter()
+    documents_in = 0
+    for document, applied in merge_join(documents, sources, run_size, directory):
+        documents_in += 1
+        hits.update(applied)
+        yield document
+
+    if total_hits is not None:
+        total_hits.update(hits)
+    count('docs_in.join', documents_in)
+    for name, annotated in hits.items():
+        count(f'docs_annotated.{name}', annotated)
 
-        for document in documents:
-            alt_metric = annotations.get(document['_id'])
-            if not alt_metric:
-                continue
-
-            if document.get('evaluations'):
-                try:
-                    document['evaluations'].append(alt_metric['evaluations'][0])
-                except:
-                    eval_object = document['evaluations']
-                    document['evaluations']=[eval_object,alt_metric['evaluations'][0]]
-            else:
-                document['evaluations'] = alt_metric['evaluations']       
-                #print(f'{document["_id"]} evaluation {document["evaluations"]}')
-                
 class Addendum:
-    def biorxiv_corrector():
-        return Correction(ANNOTATION_PATHS['preprint_updates'])
+    def biorxiv_corrector(backend='memory', store_dir=None):
+        return Correction(ANNOTATION_PATHS['preprint_updates'], backend=backend, store_dir=store_dir)
+
+    def topic_adder(backend='memory', store_dir=None):
+        return Topic(ANNOTATION_PATHS['topics_file'], backend=backend, store_dir=store_dir)
 
-    def topic_adder():
-        return Topic(ANNOTATION_PATHS['topics_file'])
+    def altmetric_adder(backend='memory', store_dir=None):
+        return Metric(ANNOTATION_PATHS['altmetrics_file'], backend=backend, store_dir=store_dir)
 
-    def altmetric_adder():
-        return Metric(ANNOTATION_PATHS['altmetrics_file'])
+    def composite_adder(backend='memory', store_dir=None):
+        return CompositeAnnotation({
+            'corrections': Addendum.biorxiv_corrector(backend=backend, store_dir=store_dir),
+            'topics':      Addendum.topic_adder(backend=backend, store_dir=store_dir),
+            'altmetrics':  Addendum.altmetric_adder(backend=backend, store_dir=store_dir),
+        })
@@ -0,0 +1,122 @@
+import os
+import sqlite3
+import hashlib
+import logging
+import threading
+
+from . import serialization
+from .serialization import iter_offsets
+
+LOOKUP_BATCH = 500
+
+def index_path(source_file, index_dir=None):
+    """
+    the index lives next to the source file unless index_dir is given,
+    in which case the name is salted with the source path to avoid collisions
+    """
+    if not index_dir:
+        return f'{source_file}.index'
+    source_file = os.path.abspath(source_file)
+    salt = hashlib.sha1(source_file.encode('utf-8')).hexdigest()[:8]
+    return os.path.join(index_dir, f'{os.path.basename(source_file)}.{salt}.index')
+
+class AnnotationStore:
+    """
+    keyed, on-disk access to an annotation file
+
+    the source (a JSON array or NDJSON) is streamed once to build an sqlite index of _id -> byte range,
+    which is reused until the source file's mtime or size changes.
+    lookups read only the requested records from the source file,
+    passing each through prepare if one is given.
+    one connection is shared by every thread, behind a lock
+    """
+    def __init__(self, source_file, prepare=None, index_dir=None):
+        self.source_file = source_file
+        self.prepare     = prepare
+        self.index_file  = index_path(source_file, index_dir)
+        stat = os.stat(source_file)
+        self.signature = (str(stat.st_mtime_ns), str(stat.st_size))
+
+        if not self.is_current():
+            self.build()
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.index_file, check_same_thread=False)
+
+    def is_current(self):
+        if not os.path.exists(self.index_file):
+            return False
+        try:
+            connection = sqlite3.connect(self.index_file)
+            try:
+                meta = dict(connection.execute('SELECT key, value FROM meta'))
+            finally:
+                connection.close()
+        except sqlite3.DatabaseError:
+            return False
+        return (meta.get('mtime_ns'), meta.get('size')) == self.signature
+
+    def build(self):
+        logging.warning(f'indexing {self.source_file}')
+        # build under a private name and swap it in, so concurrent workers
+        # never see a half-written index
+        temp_file = f'{self.index_file}.{os.getpid()}.tmp'
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+
+        connection = sqlite3.connect(temp_file)
+        try:
+            connection.execute('CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)')
+            connection.execute('CREATE TABLE records (id TEXT PRIMARY KEY, offset INTEGER, length INTEGER)')
+            # later duplicates replace earlier ones, same as building a dict from the list
+            connection.executemany(
+                'INSERT OR REPLACE INTO records VALUES (?, ?, ?)',
+                ((str(record['_id']), offset, length)
+                 for offset, length, record in iter_offsets(self.source_file)),
+            )
+            connection.executemany('INSERT INTO meta VALUES (?, ?)', [
+                ('mtime_ns', self.signature[0]),
+                ('size',     self.signature[1]),
+            ])
+            connection.commit()
+        finally:
+            connection.close()
+        os.replace(temp_file, self.index_file)
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute('SELECT COUNT(*) FROM records').fetchone()[0]
+
+    def __contains__(self, _id):
+        query = 'SELECT 1 FROM records WHERE id = ?'
+        with self.lock:
+            return self.connection.execute(query, (str(_id),)).fetchone() is not None
+
+    def get(self, _id, default=None):
+        return self.get_many([_id]).get(_id, default)
+
+    def get_many(self, ids):
+        """
+        returns {_id: annotation} for every id that has an annotation
+        """
+        ids = list(set(ids))
+        positions = []
+        for start in range(0, len(ids), LOOKUP_BATCH):
+            batch = [str(i) for i in ids[start:start + LOOKUP_BATCH]]
+            query = f'SELECT offset, length FROM records WHERE id IN ({",".join("?" * len(batch))})'
+            with self.lock:
+                positions.extend(self.connection.execute(query, batch))
+
+        found = {}
+        with open(self.source_file, 'rb') as infile:
+            # read in file order to keep seeks moving forward
+            for offset, length in sorted(positions):
+                infile.seek(offset)
+                record = serialization.loads(infile.read(length))
+                if self.prepare:
+                    record = self.prepare(record)
+                found[record['_id']] = record
+        return found
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
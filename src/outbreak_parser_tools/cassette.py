@@ -0,0 +1,195 @@
+import json
+import time
+import zlib
+import random
+import sqlite3
+import threading
+
+from functools import partial
+
+import requests
+from requests.adapters   import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils      import get_encoding_from_headers
+from requests.packages.urllib3.util.retry import Retry
+
+from . import safe_request
+
+FAILURE_STATUSES = (503,)
+BACKOFF_MAX      = 120
+# recorded bodies are already decoded, so these no longer describe them
+DROPPED_HEADERS = ('content-encoding', 'transfer-encoding')
+
+class CassetteMiss(requests.exceptions.ConnectionError):
+    """
+    a replayed request that was never recorded
+    """
+
+class Cassette:
+    """
+    recorded HTTP interactions in one sqlite file, keyed by method and url,
+    with zlib-compressed bodies. recording a request again replaces it
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute('''CREATE TABLE IF NOT EXISTS interactions (
+                key TEXT PRIMARY KEY, status INTEGER, reason TEXT, headers TEXT,
+                body BLOB, elapsed REAL, recorded_at REAL)''')
+
+    def key(self, request):
+        return f'{request.method} {request.url}'
+
+    def record(self, request, response, body, elapsed):
+        headers = {name: value for name, value in response.headers.items() if name.lower() not in DROPPED_HEADERS}
+        with self.lock, self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO interactions VALUES (?, ?, ?, ?, ?, ?, ?)', (
+                self.key(request), response.status_code, response.reason, json.dumps(headers),
+                zlib.compress(body), elapsed, time.time()))
+
+    def find(self, request):
+        """
+        (status, reason, headers, body, elapsed) as recorded for request, or None
+        """
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT status, reason, headers, body, elapsed FROM interactions WHERE key = ?', (self.key(request),)
+            ).fetchone()
+        if row is None:
+            return None
+        status, reason, headers, body, elapsed = row
+        return status, reason, json.loads(headers), zlib.decompress(body), elapsed
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute('SELECT COUNT(*) FROM interactions').fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+class RecordingAdapter(HTTPAdapter):
+    """
+    a normal HTTPAdapter that also writes every response it gets into a cassette
+    """
+    def __init__(self, cassette, **kwargs):
+        super().__init__(**kwargs)
+        self.cassette = cassette
+
+    def send(self, request, **kwargs):
+        start = time.perf_counter()
+        response = super().send(request, **kwargs)
+        # reads a streamed body as well, it stays available on the response
+        body = response.content
+        self.cassette.record(request, response, body, time.perf_counter() - start)
+        return response
+
+class ReplayAdapter(BaseAdapter):
+    """
+    answers requests from a cassette, never touching the network
+
+    each response waits latency seconds plus up to jitter more (or the time it
+    took when it was recorded, with recorded_latency). failure_rate of the
+    attempts answer with one of failure_statuses and an empty body instead, and
+    timeout_rate of them time out, as does any wait longer than the read timeout.
+    failures and timeouts are retried like max_retries would retry them live.
+    every random choice comes from an RNG seeded with seed, the request and how
+    many times it has been attempted, so a replay is the same whatever order
+    concurrent requests run in. unrecorded requests raise CassetteMiss
+    """
+    def __init__(self, cassette, latency=0.0, jitter=0.0, recorded_latency=False,
+                 failure_rate=0.0, failure_statuses=FAILURE_STATUSES, timeout_rate=0.0, seed=0,
+                 pool_connections=None, pool_maxsize=None, max_retries=0):
+        super().__init__()
+        self.cassette         = cassette
+        self.latency          = latency
+        self.jitter           = jitter
+        self.recorded_latency = recorded_latency
+        self.failure_rate     = failure_rate
+        self.failure_statuses = failure_statuses
+        self.timeout_rate     = timeout_rate
+        self.seed             = seed
+        self.max_retries      = Retry.from_int(max_retries)
+        self.attempts = {}
+        self.lock     = threading.Lock()
+
+    def rng(self, request):
+        key = self.cassette.key(request)
+        with self.lock:
+            attempt = self.attempts.get(key, 0)
+            self.attempts[key] = attempt + 1
+        return random.Random(f'{self.seed}:{key}:{attempt}')
+
+    def respond(self, request, timeout):
+        recorded = self.cassette.find(request)
+        if recorded is None:
+            raise CassetteMiss(f'{request.method} {request.url} is not in {self.cassette.path}', request=request)
+        status, reason, headers, body, elapsed = recorded
+
+        # always the same draws in the same order, so the sequence stays reproducible
+        rng = self.rng(request)
+        jitter, timed_out, failed, failure = rng.random(), rng.random(), rng.random(), rng.choice(self.failure_statuses)
+
+        delay = (elapsed if self.recorded_latency else self.latency) + jitter * self.jitter
+        read_timeout = timeout[1] if isinstance(timeout, tuple) else timeout
+        if timed_out < self.timeout_rate or (read_timeout and delay > read_timeout):
+            time.sleep(read_timeout or delay)
+            raise requests.exceptions.ReadTimeout(f'replayed timeout for {request.url}', request=request)
+        if delay:
+            time.sleep(delay)
+        if failed < self.failure_rate:
+            status, reason, headers, body = failure, 'Injected Failure', {'Content-Length': '0'}, b''
+
+        response = requests.Response()
+        response.status_code = status
+        response.reason   = reason
+        response.headers  = CaseInsensitiveDict(headers)
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = body
+        response._content_consumed = True
+        response.url      = request.url
+        response.request  = request
+        response.connection = self
+        return response
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        retry    = self.max_retries
+        retries  = retry.total or 0
+        attempts = 0
+        while True:
+            attempts += 1
+            try:
+                response = self.respond(request, timeout)
+            except requests.exceptions.ReadTimeout:
+                if attempts > retries:
+                    raise
+            else:
+                if response.status_code not in (retry.status_forcelist or ()):
+                    return response
+                if attempts > retries:
+                    raise requests.exceptions.RetryError(
+                        f'too many {response.status_code} responses for {request.url}', request=request)
+            time.sleep(min(BACKOFF_MAX, retry.backoff_factor * 2 ** (attempts - 1)))
+
+    def close(self):
+        pass
+
+def record(path, **kwargs):
+    """
+    routes safe_request through the network as usual, writing every response
+    into the cassette at path. kwargs go to the SessionManager
+    """
+    return safe_request.configure(adapter=partial(RecordingAdapter, Cassette(path)), **kwargs)
+
+def replay(path, latency=0.0, jitter=0.0, recorded_latency=False, failure_rate=0.0,
+           failure_statuses=FAILURE_STATUSES, timeout_rate=0.0, seed=0, **kwargs):
+    """
+    answers every safe_request call from the cassette at path, see ReplayAdapter.
+    kwargs go to the SessionManager, whose retry policy the replay follows
+    """
+    adapter = partial(ReplayAdapter, Cassette(path), latency=latency, jitter=jitter,
+                      recorded_latency=recorded_latency, failure_rate=failure_rate,
+                      failure_statuses=failure_statuses, timeout_rate=timeout_rate, seed=seed)
+    return safe_request.configure(adapter=adapter, **kwargs)
@@ -0,0 +1,163 @@
+import os
+import json
+import time
+import logging
+
+from . import serialization
+
+SAVE_EVERY    = 1000
+SAVE_INTERVAL = 60
+
+class Checkpoint:
+    """
+    resumable state for a long harvest, kept in directory
+
+    state.json holds each paginator's next offset, the raw items handed to the
+    transform stage but not finished yet, and whether the run gave up.
+    spill.ndjson holds every finished record, appended as it is produced,
+    and is what decides which ids are done. both are written at most every
+    save_every changes or save_interval seconds, spill first, so a crash
+    between saves only repeats work, it never loses any.
+
+        checkpoint = Checkpoint(directory)
+        yield from checkpoint.records()
+        items = chain(checkpoint.pending_items(), Paginator(endpoint, checkpoint=checkpoint, key=endpoint))
+        for item in items:
+            if checkpoint.is_done(item['global_id']):
+                continue
+            checkpoint.track(item['global_id'], item)
+            ...
+            checkpoint.add(item['global_id'], transformed)
+        checkpoint.complete()
+    """
+    def __init__(self, directory, save_every=SAVE_EVERY, save_interval=SAVE_INTERVAL):
+        self.directory     = directory
+        self.save_every    = save_every
+        self.save_interval = save_interval
+        self.state_file = os.path.join(directory, 'state.json')
+        self.spill_file = os.path.join(directory, 'spill.ndjson')
+        os.makedirs(directory, exist_ok=True)
+
+        state = {}
+        if os.path.exists(self.state_file):
+            with open(self.state_file, 'r') as infile:
+                state = json.load(infile)
+        self.offsets    = state.get('offsets', {})
+        self.finished   = set(state.get('finished', []))
+        self.pending    = state.get('pending', {})
+        self.incomplete = state.get('incomplete')
+        self.completed  = self.recover_spill()
+        if self.completed or self.offsets:
+            logging.warning(f'resuming from checkpoint {directory}: {len(self.completed)} records done')
+
+        self.spill   = open(self.spill_file, 'ab')
+        self.changes = 0
+        self.saved_at = time.monotonic()
+
+    def recover_spill(self):
+        """
+        ids of the records in the spill file, cutting off a line left half-written by a crash
+        """
+        completed = set()
+        if not os.path.exists(self.spill_file):
+            return completed
+        good = 0
+        with open(self.spill_file, 'rb') as infile:
+            for line in infile:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    completed.add(serialization.loads(line)['id'])
+                except ValueError:
+                    break
+                good += len(line)
+        with open(self.spill_file, 'rb+') as outfile:
+            outfile.truncate(good)
+        return completed
+
+    def records(self):
+        """
+        the records finished by earlier attempts at this run
+        """
+        self.spill.flush()
+        for line in serialization.iter_ndjson(self.spill_file):
+            yield line['record']
+
+    def offset(self, key):
+        return self.offsets.get(key, 0)
+
+    def advance(self, key, offset):
+        self.offsets[key] = offset
+        self.changed()
+
+    def finish(self, key):
+        self.finished.add(key)
+        self.changed()
+
+    def is_finished(self, key):
+        return key in self.finished
+
+    def is_done(self, _id):
+        return _id in self.completed or _id in self.pending
+
+    def track(self, _id, item):
+        """
+        notes a raw item handed on for transforming, so it is not lost if
+        the run dies before add() is called for it
+        """
+        self.pending[_id] = item
+        self.changed()
+
+    def pending_items(self):
+        """
+        raw items an earlier attempt handed on but never finished
+        """
+        items = list(self.pending.values())
+        self.pending = {}
+        return items
+
+    def add(self, _id, record):
+        self.spill.write(serialization.dumpb({'id': _id, 'record': record}))
+        self.spill.write(b'\n')
+        self.completed.add(_id)
+        self.pending.pop(_id, None)
+        self.changed()
+
+    def mark_incomplete(self, reason):
+        logging.error(f'run marked incomplete: {reason}')
+        self.incomplete = reason
+        self.save()
+
+    def changed(self):
+        self.changes += 1
+        if self.changes >= self.save_every or time.monotonic() - self.saved_at >= self.save_interval:
+            self.save()
+
+    def save(self):
+        self.spill.flush()
+        os.fsync(self.spill.fileno())
+        state = {
+            'offsets':    self.offsets,
+            'finished':   sorted(self.finished),
+            'pending':    self.pending,
+            'incomplete': self.incomplete,
+        }
+        temp_file = f'{self.state_file}.{os.getpid()}.tmp'
+        with open(temp_file, 'w') as outfile:
+            json.dump(state, outfile)
+        os.replace(temp_file, self.state_file)
+        self.changes  = 0
+        self.saved_at = time.monotonic()
+
+    def complete(self):
+        """
+        the run finished: clears the checkpoint so the next run starts fresh
+        """
+        self.spill.close()
+        for path in (self.state_file, self.spill_file):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def close(self):
+        self.save()
+        self.spill.close()
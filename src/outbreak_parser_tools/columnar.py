@@ -0,0 +1,147 @@
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from .      import serialization
+from .utils import chunked
+
+ROW_GROUP_SIZE = 10000
+COMPRESSION    = 'zstd'
+# fields a record has that its file's columns can't hold, as a JSON object
+EXTRA = '_extra'
+# schema metadata listing the columns that hold JSON text
+JSON_COLUMNS = b'outbreak_parser_tools.json_columns'
+TYPES = {str: 'string', bool: 'bool_', int: 'int64', float: 'float64'}
+
+def require_pyarrow():
+    if pyarrow is None:
+        raise ImportError('columnar files need pyarrow, pip install pyarrow')
+
+def is_arrow(path):
+    return path.endswith(('.arrow', '.feather'))
+
+def infer_columns(records):
+    """
+    {field: type} from a sample of records, where type is str, bool, int or
+    float when every value seen has exactly that type, and None (a JSON text
+    column) otherwise, e.g. for author, curatedBy or evaluations
+    """
+    seen = {}
+    for record in records:
+        for key, value in record.items():
+            types = seen.setdefault(key, set())
+            if value is not None:
+                types.add(type(value))
+    columns = {}
+    for key, types in seen.items():
+        kind = types.pop() if len(types) == 1 else None
+        columns[key] = kind if kind in TYPES else None
+    columns.pop(EXTRA, None)
+    return columns
+
+def arrow_schema(columns):
+    fields = [pyarrow.field(name, getattr(pyarrow, TYPES[kind])() if kind else pyarrow.string())
+              for name, kind in columns.items()]
+    fields.append(pyarrow.field(EXTRA, pyarrow.string()))
+    json_columns = [name for name, kind in columns.items() if kind is None]
+    return pyarrow.schema(fields, metadata={JSON_COLUMNS: serialization.dumpb(json_columns)})
+
+def fits(kind, value):
+    if type(value) is not kind:
+        return False
+    return kind is not int or -2 ** 63 <= value < 2 ** 63
+
+def to_table(records, columns, schema):
+    """
+    one record batch's worth of records as a table; a missing field is a null,
+    and values that don't fit their column (explicit nulls, a type that
+    differs from the one inferred, fields that aren't columns) go to EXTRA
+    """
+    data  = {name: [] for name in columns}
+    extra = []
+    for record in records:
+        values = dict.fromkeys(columns)
+        leftover = {}
+        for key, value in record.items():
+            if key not in columns:
+                leftover[key] = value
+            elif columns[key] is None:
+                values[key] = serialization.dumps(value)
+            elif fits(columns[key], value):
+                values[key] = value
+            else:
+                leftover[key] = value
+        for name, value in values.items():
+            data[name].append(value)
+        extra.append(serialization.dumps(leftover) if leftover else None)
+    data[EXTRA] = extra
+    return pyarrow.Table.from_pydict(data, schema=schema)
+
+def open_writer(destination, schema, compression):
+    if is_arrow(destination):
+        options = pyarrow.ipc.IpcWriteOptions(compression=compression)
+        return pyarrow.ipc.new_file(destination, schema, options=options)
+    return pyarrow.parquet.ParquetWriter(destination, schema, compression=compression)
+
+def write_columnar(records, destination, row_group_size=ROW_GROUP_SIZE, columns=None, compression=COMPRESSION):
+    """
+    streams records into a Parquet file, or an Arrow IPC file when destination
+    ends in .arrow or .feather, one row group per row_group_size records.
+    columns ({field: type}, see infer_columns) default to those of the first
+    row group. returns the count
+    """
+    require_pyarrow()
+    count  = 0
+    writer = None
+    try:
+        for chunk in chunked(records, row_group_size):
+            if writer is None:
+                columns = columns if columns is not None else infer_columns(chunk)
+                schema  = arrow_schema(columns)
+                writer  = open_writer(destination, schema, compression)
+            writer.write_table(to_table(chunk, columns, schema))
+            count += len(chunk)
+        if writer is None:
+            writer = open_writer(destination, arrow_schema(columns or {}), compression)
+    finally:
+        if writer is not None:
+            writer.close()
+    return count
+
+def iter_columnar(source_file, columns=None, batch_size=ROW_GROUP_SIZE):
+    """
+    yields the records of a file written by write_columnar one at a time,
+    reading batch_size rows at once. with columns, only those fields are read
+    (plus EXTRA, for values that didn't fit their column)
+    """
+    require_pyarrow()
+    if is_arrow(source_file):
+        reader = pyarrow.ipc.open_file(pyarrow.memory_map(source_file))
+        schema = reader.schema
+    else:
+        reader = pyarrow.parquet.ParquetFile(source_file)
+        schema = reader.schema_arrow
+
+    json_columns = set(serialization.loads((schema.metadata or {}).get(JSON_COLUMNS, b'[]')))
+    names = [name for name in schema.names if name != EXTRA and (columns is None or name in columns)]
+    if is_arrow(source_file):
+        batches = (reader.get_batch(i).select(names + [EXTRA]) for i in range(reader.num_record_batches))
+    else:
+        batches = reader.iter_batches(batch_size, columns=names + [EXTRA])
+
+    for batch in batches:
+        data   = batch.to_pydict()
+        extras = data.pop(EXTRA)
+        for row, extra in enumerate(extras):
+            record = {}
+            for name in names:
+                value = data[name][row]
+                if value is not None:
+                    record[name] = serialization.loads(value) if name in json_columns else value
+            if extra:
+                extra = serialization.loads(extra)
+                record.update(extra if columns is None else {k: v for k, v in extra.items() if k in columns})
+            yield record
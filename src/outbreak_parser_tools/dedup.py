@@ -0,0 +1,100 @@
+import os
+import math
+import sqlite3
+import hashlib
+import tempfile
+
+class BloomFilter:
+    """
+    fixed-size probabilistic set: no false negatives, about error_rate false
+    positives once capacity items have been added
+    """
+    def __init__(self, capacity, error_rate=0.01):
+        self.size   = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits   = bytearray((self.size + 7) // 8)
+
+    def positions(self, key):
+        digest = hashlib.blake2b(str(key).encode('utf-8'), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little')
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self.positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(key))
+
+class DiskSet:
+    """
+    exact set of ids in a temporary sqlite file under directory
+    """
+    def __init__(self, directory=None):
+        handle, self.path = tempfile.mkstemp(suffix='.sqlite', dir=directory)
+        os.close(handle)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute('CREATE TABLE ids (id TEXT PRIMARY KEY)')
+        self.count = 0
+
+    def __contains__(self, _id):
+        return self.connection.execute('SELECT 1 FROM ids WHERE id = ?', (str(_id),)).fetchone() is not None
+
+    def add(self, _id):
+        self.connection.execute('INSERT OR IGNORE INTO ids VALUES (?)', (str(_id),))
+        self.count += 1
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        self.connection.close()
+        os.remove(self.path)
+
+class Deduplicator:
+    """
+    passes each item through once per id, as items stream in
+
+    seen ids are kept in an exact in-memory set, which is the fastest option.
+    for id sets too big for memory, give a capacity: only a Bloom filter of
+    about 10 bits per id at the default error_rate stays in memory, the exact
+    ids go to an sqlite file in directory, and that file is only read for the
+    ids the filter has (probably) seen. this is slower than the set, it trades
+    speed for memory.
+    items without an id are dropped, like the '' / None global_ids in fetch_datasets
+    """
+    def __init__(self, key='global_id', capacity=None, error_rate=0.01, directory=None):
+        self.key   = key
+        self.bloom = BloomFilter(capacity, error_rate) if capacity else None
+        self.seen  = DiskSet(directory) if capacity else set()
+        self.duplicates = 0
+
+    def add(self, _id):
+        """
+        records _id, returns whether it is new
+        """
+        if self.bloom is not None and _id not in self.bloom:
+            # certainly new, no need to look at the disk
+            self.bloom.add(_id)
+            self.seen.add(_id)
+            return True
+        if _id in self.seen:
+            self.duplicates += 1
+            return False
+        self.seen.add(_id)
+        return True
+
+    def unique(self, items):
+        for item in items:
+            _id = item.get(self.key)
+            if not _id:
+                continue
+            if self.add(_id):
+                yield item
+
+    def __len__(self):
+        return len(self.seen)
+
+    def close(self):
+        if self.bloom is not None:
+            self.seen.close()
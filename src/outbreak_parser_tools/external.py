@@ -0,0 +1,79 @@
+import os
+import heapq
+import tempfile
+
+from collections import deque
+from itertools   import groupby
+
+from .      import serialization
+from .utils import chunked
+
+RUN_SIZE = 100000
+FAN_IN   = 64
+
+def sort_key(record):
+    return str(record['_id'])
+
+def write_run(records, directory):
+    handle, path = tempfile.mkstemp(suffix='.ndjson', dir=directory)
+    with os.fdopen(handle, 'wb') as outfile:
+        for record in records:
+            outfile.write(serialization.dumpb(record))
+            outfile.write(b'\n')
+    return path
+
+def merge_runs(paths, directory, fan_in=FAN_IN):
+    """
+    merges sorted runs fan_in at a time until no more than fan_in are left,
+    so only that many files are ever open, and returns an iterator over all of them.
+    heapq.merge is stable, records with the same _id keep their input order
+    """
+    while len(paths) > fan_in:
+        merged = []
+        for group in chunked(paths, fan_in):
+            merged.append(write_run(heapq.merge(*map(serialization.iter_ndjson, group), key=sort_key), directory))
+            for path in group:
+                os.remove(path)
+        paths = merged
+    return heapq.merge(*map(serialization.iter_ndjson, paths), key=sort_key)
+
+def external_sort(records, directory, run_size=RUN_SIZE, fan_in=FAN_IN):
+    """
+    sorts any number of records on _id with at most run_size of them in memory,
+    spilling sorted runs into directory
+    """
+    runs = [write_run(sorted(chunk, key=sort_key), directory) for chunk in chunked(records, run_size)]
+    return merge_runs(runs, directory, fan_in)
+
+def latest(records):
+    """
+    yields (key, record) for each _id of sorted records, the last one winning
+    as it does when the records are loaded into a dict
+    """
+    for key, group in groupby(records, key=sort_key):
+        yield key, deque(group, maxlen=1)[0]
+
+def merge_join(documents, sources, run_size=RUN_SIZE, directory=None):
+    """
+    sort-merge join of documents against annotation sources on _id
+
+    sources are (name, apply, annotations) with annotations any iterable of
+    records. documents and every source are sorted through on-disk runs, then
+    walked together, so memory holds a run while sorting and one record per
+    source while joining. yields (document, names of the sources applied to it)
+    in _id order
+    """
+    with tempfile.TemporaryDirectory(dir=directory) as spill:
+        sources = [(name, apply, latest(external_sort(annotations, spill, run_size)))
+                   for name, apply, annotations in sources]
+        heads = [next(annotations, None) for _, _, annotations in sources]
+        for document in external_sort(documents, spill, run_size):
+            key = sort_key(document)
+            applied = []
+            for i, (name, apply, annotations) in enumerate(sources):
+                while heads[i] is not None and heads[i][0] < key:
+                    heads[i] = next(annotations, None)
+                if heads[i] is not None and heads[i][0] == key:
+                    apply(document, heads[i][1])
+                    applied.append(name)
+            yield document, applied
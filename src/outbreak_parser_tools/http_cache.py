@@ -0,0 +1,138 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+import requests
+from requests.utils import get_encoding_from_headers
+
+class ResponseCache:
+    """
+    persistent cache of GET response bodies, keyed by url
+
+    bodies are files under directory, their metadata rows in an sqlite index.
+    within ttl seconds of being stored a response is served without touching
+    the network, after that it is revalidated with If-None-Match /
+    If-Modified-Since and a 304 serves the stored body. once the bodies add up
+    to more than max_bytes the least recently used ones are dropped
+    """
+    def __init__(self, directory, ttl=None, max_bytes=None):
+        self.directory = directory
+        self.ttl       = ttl
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(os.path.join(directory, 'index.sqlite'),
+                                          timeout=30, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute('''CREATE TABLE IF NOT EXISTS responses (
+                url TEXT PRIMARY KEY, headers TEXT, etag TEXT, last_modified TEXT,
+                stored_at REAL, accessed_at REAL, size INTEGER)''')
+
+    def body_path(self, url):
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, key[:2], key)
+
+    def lookup(self, url):
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT headers, etag, last_modified, stored_at FROM responses WHERE url = ?', (url,)
+            ).fetchone()
+        if not row:
+            return None
+        try:
+            with open(self.body_path(url), 'rb') as infile:
+                body = infile.read()
+        except FileNotFoundError:
+            return None
+        headers, etag, last_modified, stored_at = row
+        return {'headers': json.loads(headers), 'etag': etag, 'last_modified': last_modified,
+                'stored_at': stored_at, 'body': body}
+
+    def is_fresh(self, entry):
+        return bool(self.ttl) and time.time() - entry['stored_at'] < self.ttl
+
+    def touch(self, url, revalidated=False):
+        now = time.time()
+        with self.lock, self.connection:
+            if revalidated:
+                self.connection.execute('UPDATE responses SET stored_at = ?, accessed_at = ? WHERE url = ?', (now, now, url))
+            else:
+                self.connection.execute('UPDATE responses SET accessed_at = ? WHERE url = ?', (now, url))
+
+    def store(self, url, response):
+        etag          = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        # without validators or a ttl a stored body could never be served
+        if not (etag or last_modified or self.ttl):
+            return
+
+        path = self.body_path(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_file = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temp_file, 'wb') as outfile:
+            outfile.write(response.content)
+        os.replace(temp_file, path)
+
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)', (
+                url, json.dumps(dict(response.headers)), etag, last_modified, now, now, len(response.content)))
+        self.evict()
+
+    def evict(self):
+        if not self.max_bytes:
+            return
+        with self.lock, self.connection:
+            total = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            for url, size in self.connection.execute('SELECT url, size FROM responses ORDER BY accessed_at').fetchall():
+                if total <= self.max_bytes:
+                    break
+                self.connection.execute('DELETE FROM responses WHERE url = ?', (url,))
+                try:
+                    os.remove(self.body_path(url))
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+    def response(self, url, entry):
+        response = requests.Response()
+        response.status_code = 200
+        response.url      = url
+        response.headers  = requests.structures.CaseInsensitiveDict(entry['headers'])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = entry['body']
+        response.from_cache = True
+        return response
+
+    def get(self, session, url, **kwargs):
+        """
+        GET url through session, answering from the cache where possible
+        """
+        entry = self.lookup(url)
+        if entry and self.is_fresh(entry):
+            self.touch(url)
+            return self.response(url, entry)
+
+        headers = dict(kwargs.pop('headers', None) or {})
+        if entry and entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+
+        response = session.get(url, headers=headers, **kwargs)
+        if response.status_code == 304 and entry:
+            self.touch(url, revalidated=True)
+            return self.response(url, entry)
+        if response.status_code == 200:
+            self.store(url, response)
+        return response
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
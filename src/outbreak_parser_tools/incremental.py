@@ -0,0 +1,205 @@
+import os
+import json
+import sqlite3
+import hashlib
+import datetime
+
+from .logger import count
+from .utils  import chunked
+
+# fields that change on every run without the document changing,
+# as paths into the document (lists along the way are walked into)
+VOLATILE_FIELDS = (
+    ('curatedBy', 'curationDate'),
+)
+LOOKUP_BATCH = 500
+
+def tombstone(_id):
+    """
+    marker document for a record that has disappeared from the source
+    """
+    return {'_id': _id, '_deleted': True}
+
+class HarvestState:
+    """
+    incremental harvesting keyed on a modification date
+
+    the state file records when the last successful run finished and the id
+    and modification date of every item it saw. changed() passes through only
+    the items that are new or modified since then, tombstones() covers the ids
+    that are gone, and commit() makes this run the baseline for the next one.
+    nothing is written until commit, so a failed run is simply redone
+    """
+    def __init__(self, path, id_key='global_id', modified_key='dateModified'):
+        self.path         = path
+        self.id_key       = id_key
+        self.modified_key = modified_key
+        self.last_run = None
+        self.previous = {}
+        self.current  = {}
+
+        if os.path.exists(path):
+            with open(path, 'r') as infile:
+                state = json.load(infile)
+            self.last_run = state.get('last_run')
+            self.previous = state.get('items', {})
+
+    def changed(self, items):
+        """
+        yields new or modified items, remembering every id seen
+        """
+        for item in items:
+            _id = item.get(self.id_key)
+            if not _id:
+                continue
+            modified = item.get(self.modified_key)
+            self.current[_id] = modified
+            if modified is None or _id not in self.previous or self.previous[_id] != modified:
+                yield item
+
+    def discard(self, _id):
+        """
+        forgets an item seen this run, e.g. because its transform failed,
+        so the next run picks it up again
+        """
+        self.current.pop(_id, None)
+        self.previous.pop(_id, None)
+
+    def removed(self):
+        return [_id for _id in self.previous if _id not in self.current]
+
+    def tombstones(self, id_func=None):
+        """
+        only meaningful after a complete harvest, since anything not seen counts as deleted
+        id_func maps a harvested id onto the uploaded document's _id
+        """
+        for _id in self.removed():
+            yield tombstone(id_func(_id) if id_func else _id)
+
+    def commit(self):
+        state = {
+            'last_run': datetime.datetime.now().isoformat(),
+            'items':    self.current,
+        }
+        temp_file = f'{self.path}.{os.getpid()}.tmp'
+        with open(temp_file, 'w') as outfile:
+            json.dump(state, outfile)
+        os.replace(temp_file, self.path)
+
+        self.last_run = state['last_run']
+        self.previous = self.current
+        self.current  = {}
+
+def without(value, path):
+    """
+    value with the field at path removed, copying only what lies along the path
+    """
+    if isinstance(value, list):
+        return [without(item, path) for item in value]
+    if not isinstance(value, dict) or path[0] not in value:
+        return value
+    if len(path) == 1:
+        return {key: item for key, item in value.items() if key != path[0]}
+    return {**value, path[0]: without(value[path[0]], path[1:])}
+
+def fingerprint(document, volatile=VOLATILE_FIELDS):
+    """
+    hash of a document's content, the same whatever its key order and
+    whatever its volatile fields hold. always the stdlib encoder, so the
+    hash doesn't depend on whether orjson is installed
+    """
+    for path in volatile:
+        document = without(document, path)
+    canonical = json.dumps(document, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+    return hashlib.blake2b(canonical.encode('utf-8'), digest_size=16).hexdigest()
+
+class FingerprintIndex:
+    """
+    content-hash change detection against the previous release
+
+    an sqlite file keeps the fingerprint of every document of the last
+    committed run. changed() passes through only documents that are new or
+    whose fingerprint differs, tombstones() covers the ids that are gone,
+    and commit() makes this run the baseline, in one transaction. a run
+    that is never committed leaves the previous baseline as it was.
+    it goes last, after the transform and the annotations:
+
+        index = FingerprintIndex('dataverses_fingerprints.sqlite')
+        documents = Addendum.composite_adder().stream(load_annotations())
+        count = write_ndjson(index.delta(documents), 'delta.ndjson')
+        index.commit()
+    """
+    def __init__(self, path, id_key='_id', volatile=VOLATILE_FIELDS):
+        self.path     = path
+        self.id_key   = id_key
+        self.volatile = volatile
+        self.inserted  = 0
+        self.modified  = 0
+        self.unchanged = 0
+        self.connection = sqlite3.connect(path)
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS previous (id TEXT PRIMARY KEY, hash TEXT)')
+            # left over from a run that was never committed
+            self.connection.execute('DROP TABLE IF EXISTS current')
+            self.connection.execute('CREATE TABLE current (id TEXT PRIMARY KEY, hash TEXT)')
+
+    def changed(self, documents, chunk_size=LOOKUP_BATCH):
+        """
+        yields inserted or changed documents, remembering every fingerprint seen
+        """
+        for chunk in chunked(documents, chunk_size):
+            hashes = [(str(document[self.id_key]), fingerprint(document, self.volatile)) for document in chunk]
+            ids = list({_id for _id, _ in hashes})
+            query = f'SELECT id, hash FROM previous WHERE id IN ({",".join("?" * len(ids))})'
+            previous = dict(self.connection.execute(query, ids))
+            with self.connection:
+                self.connection.executemany('INSERT OR REPLACE INTO current VALUES (?, ?)', hashes)
+
+            unchanged = [previous.get(_id) == digest for _id, digest in hashes]
+            inserted  = sum(_id not in previous for _id, _ in hashes)
+            self.inserted  += inserted
+            self.modified  += len(chunk) - inserted - sum(unchanged)
+            self.unchanged += sum(unchanged)
+            count('docs_unchanged', sum(unchanged))
+
+            for document, skip in zip(chunk, unchanged):
+                if not skip:
+                    yield document
+
+    def discard(self, _id):
+        """
+        forgets a document seen this run, e.g. because its upload failed,
+        so the next run sends it again
+        """
+        with self.connection:
+            self.connection.execute('DELETE FROM current WHERE id = ?', (str(_id),))
+            self.connection.execute('DELETE FROM previous WHERE id = ?', (str(_id),))
+
+    def removed(self):
+        query = 'SELECT id FROM previous WHERE id NOT IN (SELECT id FROM current)'
+        return [_id for _id, in self.connection.execute(query)]
+
+    def tombstones(self):
+        """
+        only meaningful after a complete run, since anything not seen counts as deleted
+        """
+        for _id in self.removed():
+            yield tombstone(_id)
+
+    def delta(self, documents):
+        """
+        the inserted and changed documents, then tombstones for the deleted ones
+        """
+        yield from self.changed(documents)
+        yield from self.tombstones()
+
+    def commit(self):
+        with self.connection:
+            # DDL doesn't open a transaction by itself, and the swap has to be atomic
+            self.connection.execute('BEGIN')
+            self.connection.execute('DROP TABLE previous')
+            self.connection.execute('ALTER TABLE current RENAME TO previous')
+            self.connection.execute('CREATE TABLE current (id TEXT PRIMARY KEY, hash TEXT)')
+
+    def close(self):
+        self.connection.close()
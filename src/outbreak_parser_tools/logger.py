@@ -1,9 +1,21 @@
+import json
+import time
+import logging
+import datetime
+import functools
+import threading
+import inspect
+
+from collections import Counter
+from contextlib  import contextmanager
+
+REPORT_INTERVAL = 60
+
 def get_logger(name):
     try:
         from biothings import config
         logger = config.logger
     except ImportError:
-        import logging
         logger = logging.getLogger(name)
         logger.setLevel(logging.DEBUG)
         handler = logging.FileHandler(f'{name}_log.log')
@@ -12,3 +24,118 @@ def get_logger(name):
         logger.addHandler(handler)
 
     return logger
+
+class Metrics:
+    """
+    counters and per-stage timings for one run
+
+    counters are free-form names, the toolkit itself keeps docs_in.<annotator>,
+    docs_annotated.<annotator>, pages, http_requests, http_retries, http_errors,
+    cache_hits and bytes, and times its stages with the same names.
+    every `interval` seconds the counters' rates since the last report are
+    logged, and summary() / write_summary() give the whole run as JSON
+    """
+    def __init__(self, logger=None, interval=REPORT_INTERVAL):
+        self.logger   = logger or logging.getLogger('outbreak_parser_tools.metrics')
+        self.interval = interval
+        self.lock     = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started  = time.time()
+            self.counters = Counter()
+            self.timings  = {}
+            self.last_report = time.monotonic()
+            self.last_counts = Counter()
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+        self.report()
+
+    def record(self, stage, seconds):
+        with self.lock:
+            timing = self.timings.setdefault(stage, {'calls': 0, 'seconds': 0.0, 'max': 0.0})
+            timing['calls']   += 1
+            timing['seconds'] += seconds
+            timing['max']      = max(timing['max'], seconds)
+        self.report()
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def timed(self, stage=None):
+        """
+        decorator timing every call under stage (default: the function's name);
+        for generator functions the time spent producing each item is what counts
+        """
+        def decorator(func):
+            name = stage or func.__qualname__
+            if inspect.isgeneratorfunction(func):
+                @functools.wraps(func)
+                def generator_wrapper(*args, **kwargs):
+                    iterator = func(*args, **kwargs)
+                    while True:
+                        start = time.perf_counter()
+                        try:
+                            item = next(iterator)
+                        except StopIteration:
+                            return
+                        finally:
+                            self.record(name, time.perf_counter() - start)
+                        yield item
+                return generator_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def report(self, force=False):
+        now = time.monotonic()
+        with self.lock:
+            elapsed = now - self.last_report
+            if not force and elapsed < self.interval:
+                return
+            rates = {name: (count - self.last_counts[name]) / elapsed if elapsed else 0.0
+                     for name, count in self.counters.items()}
+            self.last_report = now
+            self.last_counts = Counter(self.counters)
+        if rates:
+            self.logger.info('throughput ' + ', '.join(f'{name} {rate:.1f}/s' for name, rate in sorted(rates.items())))
+
+    def summary(self):
+        with self.lock:
+            return {
+                'started':  datetime.datetime.fromtimestamp(self.started).isoformat(),
+                'elapsed':  time.time() - self.started,
+                'counters': dict(self.counters),
+                'timings':  {stage: dict(timing) for stage, timing in self.timings.items()},
+            }
+
+    def write_summary(self, path):
+        with open(path, 'w') as outfile:
+            json.dump(self.summary(), outfile, indent=2)
+
+    def log_summary(self):
+        self.logger.info(f'run summary {json.dumps(self.summary())}')
+
+# process-wide metrics the toolkit reports to
+metrics = Metrics()
+
+def count(name, amount=1):
+    metrics.count(name, amount)
+
+def timer(stage):
+    return metrics.timer(stage)
+
+def timed(stage=None):
+    return metrics.timed(stage)
@@ -0,0 +1,216 @@
+import asyncio
+import logging
+
+from collections        import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools          import partial
+
+from .       import safe_request
+from .logger import count
+
+TIMEOUT     = 300
+PER_PAGE    = 1000
+CONCURRENCY = 8
+MAX_RETRIES = 6
+# times in a row one page may be throttled before it counts as a failure
+MAX_THROTTLES = 10
+# after the first failure pages shrink to 200 items, after that to 50
+FALLBACK_PAGE_SIZES = (200, 50)
+
+class IncompleteHarvest(Exception):
+    """
+    raised when paging gives up before reaching the end, instead of
+    handing back a silently truncated result
+    """
+
+def fetch_json(url, timeout=TIMEOUT, retry_after=True):
+    response = safe_request.get(url, timeout=timeout, retry_after=retry_after)
+    # an error status is raised with its response, so a 429 / 503 can be told apart
+    response.raise_for_status()
+    return response.json()
+
+def dataverse_page(response):
+    """
+    returns (total_count, items) from a dataverse search response
+    """
+    data = response.get('data')
+    return data.get('total_count'), data.get('items')
+
+class Paginator:
+    """
+    pages through a search endpoint, requesting up to `concurrency` pages at once
+
+    the first page is fetched alone to learn the total, after which every
+    remaining offset is known and is fanned out. a page that fails is split
+    into smaller pages and requested again, and later pages use the smaller
+    size too. pages are handed back in offset order, and giving up raises
+    IncompleteHarvest.
+
+    fetching through safe_request, no more pages are requested at once than
+    the session manager keeps connections to the host for.
+
+    with a checkpoint.Checkpoint, paging starts from the offset saved under key
+    (default the endpoint), which is moved on once each page has been consumed.
+
+    with a throttle.AdaptiveController, page size and concurrency follow the
+    controller instead of the fixed fallback sizes, requests wait out its
+    pauses, and throttled pages are asked for again without using up a retry,
+    up to max_throttles times in a row for the same offset. 429 and 503
+    responses then reach the controller instead of being retried by urllib3
+    """
+    def __init__(self, query_endpoint, per_page=PER_PAGE, concurrency=CONCURRENCY,
+                 timeout=TIMEOUT, fetch=None, read_page=dataverse_page, max_retries=MAX_RETRIES,
+                 checkpoint=None, key=None, controller=None, max_throttles=MAX_THROTTLES):
+        self.query_endpoint = query_endpoint
+        self.checkpoint  = checkpoint
+        self.key         = key or query_endpoint
+        self.position    = checkpoint.offset(self.key) if checkpoint else 0
+        self.per_page    = per_page
+        self.concurrency = concurrency
+        self.fetch       = fetch or partial(fetch_json, timeout=timeout, retry_after=controller is None)
+        self.read_page   = read_page
+        self.max_retries = max_retries
+        self.controller  = controller
+        self.workers     = controller.max_concurrency if controller else concurrency
+        if fetch is None:
+            self.workers = min(self.workers, safe_request.session_manager().pool_size(query_endpoint))
+        self.max_throttles = max_throttles
+        self.throttled     = {}
+        self.retries     = 0
+        self.total       = None
+
+    def page_url(self, start, per_page):
+        return f"{self.query_endpoint}&per_page={per_page}&start={start}"
+
+    def page_size(self):
+        return self.controller.per_page if self.controller else self.per_page
+
+    def page_limit(self):
+        return min(self.controller.concurrency if self.controller else self.concurrency, self.workers)
+
+    def failed(self, url, start, size, error):
+        """
+        records a failed page, returns the smaller pages to request in its place
+        or None once there have been too many failures
+        """
+        logging.error(f"Failed to get {url} due to {error}")
+        if self.controller and self.controller.failure(error):
+            throttles = self.throttled.get(start, 0) + 1
+            self.throttled[start] = throttles
+            if throttles <= self.max_throttles:
+                return [(start, size)]
+            logging.error(f"{url} throttled {throttles} times in a row")
+            # the retry, if there is one, gets a fresh allowance
+            del self.throttled[start]
+        if self.retries >= self.max_retries:
+            logging.error("Failed too many times")
+            return None
+        self.retries += 1
+        if not self.controller:
+            fallback = FALLBACK_PAGE_SIZES[min(self.retries, len(FALLBACK_PAGE_SIZES)) - 1]
+            self.per_page = min(self.per_page, fallback)
+        per_page = self.page_size()
+        return [(offset, min(per_page, start + size - offset))
+                for offset in range(start, start + size, per_page)]
+
+    async def pages(self):
+        """
+        async generator of (start, items), in offset order
+        """
+        loop     = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(self.workers)
+        position = self.position
+        queue    = deque([(position, self.page_size())])
+        running  = {}
+        finished = {}
+        next_start = position + self.page_size()
+
+        try:
+            while True:
+                delay = self.controller.delay() if self.controller else 0
+                # until the first page reports a total only one request is in flight
+                limit = 0 if delay else 1 if self.total is None else self.page_limit()
+                while len(running) < limit:
+                    if queue:
+                        start, size = queue.popleft()
+                    elif self.total is not None and next_start < self.total:
+                        start, size = next_start, min(self.page_size(), self.total - next_start)
+                        next_start += size
+                    else:
+                        break
+                    url = self.page_url(start, size)
+                    logging.info(f"getting {url}")
+                    future = loop.run_in_executor(executor, self.fetch, url)
+                    running[future] = (url, start, size, loop.time())
+
+                if not running:
+                    if delay and (queue or self.total is None or next_start < self.total):
+                        await asyncio.sleep(delay)
+                        continue
+                    return
+
+                done, _ = await asyncio.wait(running, timeout=delay or None, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    url, start, size, started = running.pop(future)
+                    try:
+                        total, items = self.read_page(future.result())
+                    except Exception as pageException:
+                        smaller = self.failed(url, start, size, pageException)
+                        if smaller is None:
+                            reason = f"gave up paging {self.query_endpoint} at offset {start}"
+                            if self.checkpoint:
+                                self.checkpoint.mark_incomplete(reason)
+                            raise IncompleteHarvest(reason)
+                        queue.extendleft(reversed(smaller))
+                        continue
+                    if self.controller:
+                        self.controller.success(loop.time() - started)
+                        self.throttled.pop(start, None)
+                    if self.total is None:
+                        self.total = total or 0
+                    finished[start] = (size, items)
+                    count('pages')
+
+                while position in finished:
+                    size, items = finished.pop(position)
+                    position += size
+                    self.position = position
+                    yield position - size, items
+        finally:
+            for future in running:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def __iter__(self):
+        """
+        yields items as their pages arrive, driving pages() on a private event loop
+        """
+        if self.checkpoint and self.checkpoint.is_finished(self.key):
+            return
+        loop  = asyncio.new_event_loop()
+        pages = self.pages()
+        try:
+            while True:
+                try:
+                    _, items = loop.run_until_complete(pages.__anext__())
+                except StopAsyncIteration:
+                    if self.checkpoint:
+                        self.checkpoint.finish(self.key)
+                    return
+                yield from items
+                if self.checkpoint:
+                    self.checkpoint.advance(self.key, self.position)
+        finally:
+            loop.run_until_complete(pages.aclose())
+            loop.close()
+
+def iter_paginated_data(query_endpoint, per_page=PER_PAGE, **kwargs):
+    return iter(Paginator(query_endpoint, per_page=per_page, **kwargs))
+
+def compile_paginated_data(query_endpoint, per_page=PER_PAGE, **kwargs):
+    """
+    pages through data, compiling all response['data']['items']
+    and returning them.
+    per_page max is 1000
+    """
+    return list(iter_paginated_data(query_endpoint, per_page=per_page, **kwargs))
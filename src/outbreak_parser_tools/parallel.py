@@ -0,0 +1,126 @@
+import os
+import logging
+
+from collections        import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from functools          import partial
+
+from .       import serialization
+from .logger import count, timer
+from .utils  import chunked
+
+MAX_WORKERS = 8
+CHUNK_SIZE  = 500
+
+def imap_bounded(func, iterable, max_workers=MAX_WORKERS, max_pending=None, ordered=False, executor=None):
+    """
+    runs func over iterable on a thread pool (or the given executor)
+    and yields results as they complete, or in input order when ordered
+
+    jobs are pulled from iterable lazily, with at most max_pending
+    (default twice max_workers) submitted and not yet consumed
+    """
+    max_pending = max_pending or 2 * max_workers
+    iterator  = iter(iterable)
+    pending   = deque() if ordered else set()
+    submitted = pending.append if ordered else pending.add
+    exhausted = False
+
+    owned    = executor is None
+    executor = executor or ThreadPoolExecutor(max_workers)
+    try:
+        while True:
+            while not exhausted and len(pending) < max_pending:
+                try:
+                    job = next(iterator)
+                except StopIteration:
+                    exhausted = True
+                    break
+                submitted(executor.submit(func, job))
+
+            if not pending:
+                return
+
+            if ordered:
+                yield pending.popleft().result()
+                continue
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            pending -= done
+            for future in done:
+                yield future.result()
+    finally:
+        if owned:
+            executor.shutdown()
+
+def fetch_and_transform(jobs, fetch, transform, fallback=None, max_workers=MAX_WORKERS, max_pending=None):
+    """
+    concurrent fetch -> fallback -> transform stage
+
+    jobs are (id, url) pairs. fetch(id, url) is tried first and fallback(id, url)
+    when it gives nothing back, then transform(record, id) runs on the result.
+    yields (id, transformed) as jobs complete; jobs that get no record or raise
+    are logged and skipped
+    """
+    def run(job):
+        _id, url = job
+        try:
+            with timer('fetch'):
+                record = fetch(_id, url)
+                if not record and fallback:
+                    record = fallback(_id, url)
+            if not record:
+                logging.warning(f"no record for {_id}")
+                return _id, None
+            with timer('transform'):
+                return _id, transform(record, _id)
+        except Exception as jobException:
+            logging.error(f"Failed to fetch and transform {_id} from {url} due to {jobException}")
+            return _id, None
+
+    for _id, transformed in imap_bounded(run, jobs, max_workers=max_workers, max_pending=max_pending):
+        if transformed is not None:
+            yield _id, transformed
+
+def transform_block(transform, block):
+    """
+    worker side of transform_records: block is NDJSON of [id, record] pairs,
+    the result is NDJSON of [id, transformed] for the records that transformed
+    """
+    lines = []
+    for line in block.split(b'\n'):
+        _id, record = serialization.loads(line)
+        try:
+            transformed = transform(record, _id)
+        except Exception as transformException:
+            logging.error(f"Failed to transform {_id} due to {transformException}")
+            continue
+        if transformed is not None:
+            lines.append(serialization.dumpb([_id, transformed]))
+    return b'\n'.join(lines)
+
+def transform_records(records, transform, processes=None, chunk_size=CHUNK_SIZE, ordered=False, max_pending=None, mp_context=None):
+    """
+    CPU-bound transform stage spread over a process pool, e.g. for re-transforming
+    an archived dump of schema exports
+
+    records are (id, record) pairs and transform(record, id) runs in the workers,
+    so it has to be picklable, i.e. a module-level function. records go to the
+    workers chunk_size at a time, each chunk serialized once into a single bytes
+    block and the results come back the same way, instead of pickling every
+    dict on the way there and back. yields (id, transformed) as chunks finish,
+    or in input order when ordered; records whose transform raises or returns
+    None are logged and skipped
+    """
+    processes = processes or os.cpu_count()
+    blocks = (b'\n'.join(serialization.dumpb([_id, record]) for _id, record in chunk)
+              for chunk in chunked(records, chunk_size))
+
+    with ProcessPoolExecutor(processes, mp_context=mp_context) as executor:
+        for block in imap_bounded(partial(transform_block, transform), blocks, max_workers=processes,
+                                  max_pending=max_pending, ordered=ordered, executor=executor):
+            if not block:
+                continue
+            results = [serialization.loads(line) for line in block.split(b'\n')]
+            count('transformed', len(results))
+            for _id, transformed in results:
+                yield _id, transformed
@@ -1,25 +1,182 @@
+import logging
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse       import urlsplit
+
 import requests
 from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.util.retry import Retry
 
-def requests_retry_session(retries=3, backoff_factor=0.3, status_forcelist=(500, 502, 504), session=None):
+from .logger import count, timer
+
+TIMEOUT      = 45
+POOL_MAXSIZE = 10
+MAX_WORKERS  = 8
+
+def retry_policy(retries=3, backoff_factor=0.3, status_forcelist=(500, 502, 504), retry_after=True):
     """
-    request backoff + retry helper
-    https://www.peterbe.com/plog/best-practice-with-retries-with-requests
+    without retry_after, 429 and 503 responses are handed back instead of
+    being retried once their Retry-After has passed
     """
-
-    session = session or requests.Session()
-    retry = Retry(
+    if not retry_after:
+        status_forcelist = tuple(s for s in status_forcelist if s not in Retry.RETRY_AFTER_STATUS_CODES)
+    return Retry(
             total=retries,
             read=retries,
             connect=retries,
             backoff_factor=backoff_factor,
             status_forcelist=status_forcelist,
+            respect_retry_after_header=retry_after,
             )
+
+def requests_retry_session(retries=3, backoff_factor=0.3, status_forcelist=(500, 502, 504), session=None):
+    """
+    request backoff + retry helper
+    https://www.peterbe.com/plog/best-practice-with-retries-with-requests
+    """
+
+    session = session or requests.Session()
+    retry = retry_policy(retries, backoff_factor, status_forcelist)
     adapter = HTTPAdapter(max_retries=retry)
     session.mount('http://', adapter)
     session.mount('https://', adapter)
     return session
 
-def get(url):
-    return requests_retry_session().get(url, timeout=45)
+def record_response(response, streamed=False):
+    if getattr(response, 'from_cache', False):
+        count('cache_hits')
+    else:
+        count('http_requests')
+        retries = getattr(getattr(response, 'raw', None), 'retries', None)
+        if retries is not None and retries.history:
+            count('http_retries', len(retries.history))
+    if not streamed:
+        count('bytes', len(response.content))
+
+class SessionManager:
+    """
+    long-lived sessions that keep connections (and TLS sessions) alive between requests
+
+    every host gets one adapter, i.e. one connection pool, sized by host_pool_sizes
+    or pool_maxsize. sessions aren't safe to share between threads, so each thread
+    gets its own, but all of them are mounted on the same per-host adapters.
+    with a cache (an http_cache.ResponseCache) plain GETs are served through it.
+    adapter builds the per-host adapters, called like HTTPAdapter, e.g. a
+    cassette.RecordingAdapter or ReplayAdapter bound to its cassette.
+    requests made with retry_after=False go through adapters of their own,
+    which leave 429 and 503 responses to the caller (see retry_policy)
+    """
+    def __init__(self, pool_maxsize=POOL_MAXSIZE, host_pool_sizes=None,
+                 retries=3, backoff_factor=0.3, status_forcelist=(500, 502, 504), cache=None, adapter=None):
+        self.retry = retry_policy(retries, backoff_factor, status_forcelist)
+        self.paced_retry = retry_policy(retries, backoff_factor, status_forcelist, retry_after=False)
+        self.cache = cache
+        self.adapter_factory = adapter or HTTPAdapter
+        self.pool_maxsize    = pool_maxsize
+        self.host_pool_sizes = dict(host_pool_sizes or {})
+        self.adapters = {}
+        self.lock  = threading.Lock()
+        self.local = threading.local()
+
+    def pool_size(self, url):
+        """
+        how many connections to url's host are kept alive
+        """
+        return self.host_pool_sizes.get(urlsplit(url).netloc, self.pool_maxsize)
+
+    def adapter(self, prefix, retry_after=True):
+        with self.lock:
+            if (prefix, retry_after) not in self.adapters:
+                retry = self.retry if retry_after else self.paced_retry
+                self.adapters[prefix, retry_after] = self.adapter_factory(
+                    pool_connections=1, pool_maxsize=self.pool_size(prefix), max_retries=retry)
+            return self.adapters[prefix, retry_after]
+
+    def session(self, url=None, retry_after=True):
+        """
+        the calling thread's session, with url's host mounted on its shared adapter
+        """
+        sessions = getattr(self.local, 'sessions', None)
+        if sessions is None:
+            sessions = self.local.sessions = {}
+        session = sessions.get(retry_after)
+        if session is None:
+            session = requests.Session()
+            session.mount('http://',  self.adapter('http://', retry_after))
+            session.mount('https://', self.adapter('https://', retry_after))
+            sessions[retry_after] = session
+        if url:
+            parts  = urlsplit(url)
+            prefix = f'{parts.scheme}://{parts.netloc}/'
+            if prefix not in session.adapters:
+                session.mount(prefix, self.adapter(prefix, retry_after))
+        return session
+
+    def get(self, url, timeout=TIMEOUT, retry_after=True, **kwargs):
+        session = self.session(url, retry_after)
+        try:
+            with timer('http.get'):
+                if self.cache is not None and not kwargs.get('params'):
+                    response = self.cache.get(session, url, timeout=timeout, **kwargs)
+                else:
+                    response = session.get(url, timeout=timeout, **kwargs)
+        except Exception:
+            count('http_errors')
+            raise
+        record_response(response, streamed=kwargs.get('stream', False))
+        return response
+
+    def get_many(self, urls, max_workers=MAX_WORKERS, timeout=TIMEOUT, **kwargs):
+        """
+        fetches urls concurrently over the shared pools
+        returns the responses in the order of urls, None where a request failed
+        """
+        def fetch(url):
+            try:
+                return self.get(url, timeout=timeout, **kwargs)
+            except Exception as requestException:
+                logging.error(f"Failed to get {url} due to {requestException}")
+                return None
+
+        with ThreadPoolExecutor(max_workers) as executor:
+            return list(executor.map(fetch, urls))
+
+    def close(self):
+        with self.lock:
+            for adapter in self.adapters.values():
+                adapter.close()
+            self.adapters = {}
+        if self.cache is not None:
+            self.cache.close()
+
+_manager      = None
+_manager_lock = threading.Lock()
+
+def session_manager():
+    """
+    the process-wide SessionManager used by get and get_many
+    """
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = SessionManager()
+        return _manager
+
+def configure(**kwargs):
+    """
+    replaces the process-wide SessionManager, e.g.
+    configure(cache=ResponseCache('/data/http_cache', ttl=3600, max_bytes=2**30))
+    """
+    global _manager
+    with _manager_lock:
+        if _manager is not None:
+            _manager.close()
+        _manager = SessionManager(**kwargs)
+        return _manager
+
+def get(url, timeout=TIMEOUT, **kwargs):
+    return session_manager().get(url, timeout=timeout, **kwargs)
+
+def get_many(urls, max_workers=MAX_WORKERS, timeout=TIMEOUT, **kwargs):
+    return session_manager().get_many(urls, max_workers=max_workers, timeout=timeout, **kwargs)
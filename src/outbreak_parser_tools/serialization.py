@@ -0,0 +1,183 @@
+import json
+import codecs
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# the engine behind loads/dumps: orjson when it is installed, else the stdlib
+ENGINE = 'orjson' if orjson else 'json'
+
+CHUNK_SIZE = 1 << 20
+WHITESPACE = ' \t\n\r'
+
+def loads(data):
+    if orjson:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def dumpb(obj):
+    """
+    compact JSON as utf-8 bytes
+    """
+    if orjson:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            # e.g. non-string keys, which the stdlib coerces
+            pass
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+def dumps(obj):
+    return dumpb(obj).decode('utf-8')
+
+def load(path):
+    """
+    parses a whole JSON file at once
+    """
+    with open(path, 'rb') as infile:
+        return loads(infile.read())
+
+def is_json_array(path):
+    """
+    whether path holds a JSON array rather than NDJSON, going by its first character
+    """
+    with open(path, 'rb') as infile:
+        while True:
+            char = infile.read(1)
+            if not char or char not in b' \t\n\r':
+                return char == b'['
+
+def iter_json_array(source_file, chunk_size=CHUNK_SIZE):
+    """
+    streams a file holding a top-level JSON array
+    yields (offset, length, record) for every element, where offset and length
+    are byte positions in the source file, without parsing the whole file at once
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+
+    with open(source_file, 'rb') as infile:
+        buffer = ''
+        index  = 0
+        offset = 0
+        eof    = False
+        opened = False
+
+        while True:
+            if index >= len(buffer):
+                if eof:
+                    raise ValueError(f'{source_file} ended before the JSON array was closed')
+                chunk  = infile.read(chunk_size)
+                eof    = not chunk
+                buffer = buffer[index:] + text_decoder.decode(chunk, final=eof)
+                index  = 0
+                continue
+
+            char = buffer[index]
+            if char in WHITESPACE or (opened and char == ','):
+                index  += 1
+                offset += 1
+                continue
+
+            if not opened:
+                if char != '[':
+                    raise ValueError(f'{source_file} does not hold a JSON array')
+                opened  = True
+                index  += 1
+                offset += 1
+                continue
+
+            if char == ']':
+                return
+
+            try:
+                record, end = decoder.raw_decode(buffer, index)
+                complete = end < len(buffer) or eof
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                complete = False
+
+            if not complete:
+                # element runs past the end of the buffer, read more and retry
+                chunk  = infile.read(chunk_size)
+                eof    = not chunk
+                buffer = buffer[index:] + text_decoder.decode(chunk, final=eof)
+                index  = 0
+                continue
+
+            length = len(buffer[index:end].encode('utf-8'))
+            yield offset, length, record
+            offset += length
+            index   = end
+
+def iter_ndjson_offsets(source_file):
+    """
+    yields (offset, length, record) for every line of an NDJSON file
+    """
+    with open(source_file, 'rb') as infile:
+        offset = 0
+        for line in infile:
+            record = line.strip()
+            if record:
+                yield offset, len(line.rstrip(b'\r\n')), loads(record)
+            offset += len(line)
+
+def iter_offsets(source_file):
+    """
+    (offset, length, record) for every record of a JSON array or NDJSON file
+    """
+    if is_json_array(source_file):
+        return iter_json_array(source_file)
+    return iter_ndjson_offsets(source_file)
+
+def iter_ndjson(source_file):
+    for _, _, record in iter_ndjson_offsets(source_file):
+        yield record
+
+def iter_records(source_file):
+    """
+    streams the records of a JSON array or NDJSON file one at a time
+    """
+    for _, _, record in iter_offsets(source_file):
+        yield record
+
+def read_records(source_file):
+    """
+    all records of a JSON array or NDJSON file as a list; arrays are parsed
+    in one go with the fast engine, which beats streaming when everything
+    is kept in memory anyway
+    """
+    if is_json_array(source_file):
+        return load(source_file)
+    return list(iter_ndjson(source_file))
+
+def write_ndjson(records, destination):
+    """
+    writes records one per line as they are produced, returns the count
+    """
+    count = 0
+    with open(destination, 'wb') as outfile:
+        for record in records:
+            outfile.write(dumpb(record))
+            outfile.write(b'\n')
+            count += 1
+    return count
+
+def write_json_array(records, destination):
+    """
+    writes records as a JSON array as they are produced, without building
+    the list first, returns the count
+    """
+    count = 0
+    with open(destination, 'wb') as outfile:
+        outfile.write(b'[')
+        for record in records:
+            if count:
+                outfile.write(b',\n')
+            outfile.write(dumpb(record))
+            count += 1
+        outfile.write(b']\n')
+    return count
@@ -0,0 +1,154 @@
+import os
+import mmap
+import struct
+import hashlib
+import logging
+import tempfile
+
+from . import serialization
+
+MAGIC  = b'OPTSNAP2'
+HEADER = struct.Struct('<8sQQQQQQ')  # magic, source mtime_ns, source size, count, keys offset, values offset, file length
+ENTRY  = struct.Struct('<QIQI')     # key offset, key length, value offset, value length
+
+def snapshot_path(source_file, prepare=None, snapshot_dir=None):
+    """
+    snapshots are keyed on the source file and the prepare function,
+    since the stored values are the prepared ones
+    """
+    tag = getattr(prepare, '__qualname__', 'raw').replace('.', '_').lower()
+    if not snapshot_dir:
+        return f'{source_file}.{tag}.snapshot'
+    source_file = os.path.abspath(source_file)
+    salt = hashlib.sha1(source_file.encode('utf-8')).hexdigest()[:8]
+    return os.path.join(snapshot_dir, f'{os.path.basename(source_file)}.{salt}.{tag}.snapshot')
+
+def build_snapshot(source_file, path, prepare=None):
+    """
+    compiles a JSON array or NDJSON annotation file into a sorted, keyed binary file:
+    a header, a fixed-width entry table sorted by key, the keys, then the
+    prepared records as compact JSON. the header ends with the file's length,
+    so a snapshot cut short anywhere is noticed
+    """
+    logging.warning(f'compiling snapshot of {source_file}')
+    stat = os.stat(source_file)
+    directory = os.path.dirname(os.path.abspath(path))
+
+    # values are spooled to disk as they stream in, only the keys stay in memory
+    positions = {}
+    with tempfile.TemporaryFile(dir=directory) as values:
+        for _, _, record in serialization.iter_offsets(source_file):
+            if prepare:
+                record = prepare(record)
+            value = serialization.dumpb(record)
+            # later duplicates win, same as building a dict from the list
+            positions[str(record['_id']).encode('utf-8')] = (values.tell(), len(value))
+            values.write(value)
+
+        keys = sorted(positions)
+        keys_offset   = HEADER.size + ENTRY.size * len(keys)
+        values_offset = keys_offset + sum(len(key) for key in keys)
+        length        = values_offset + values.tell()
+
+        temp_file = f'{path}.{os.getpid()}.tmp'
+        with open(temp_file, 'wb') as outfile:
+            outfile.write(HEADER.pack(MAGIC, stat.st_mtime_ns, stat.st_size, len(keys), keys_offset, values_offset, length))
+            key_position = keys_offset
+            for key in keys:
+                value_position, value_length = positions[key]
+                outfile.write(ENTRY.pack(key_position, len(key), values_offset + value_position, value_length))
+                key_position += len(key)
+            for key in keys:
+                outfile.write(key)
+            values.seek(0)
+            while True:
+                block = values.read(1 << 20)
+                if not block:
+                    break
+                outfile.write(block)
+
+    # swap in atomically so readers in other workers never map a partial file
+    os.replace(temp_file, path)
+
+class AnnotationSnapshot:
+    """
+    read-only, memory-mapped view of a compiled annotation snapshot
+
+    every worker maps the same file, so the pages are shared between processes.
+    the snapshot is recompiled when the source file's mtime or size changes
+    """
+    def __init__(self, source_file, prepare=None, snapshot_dir=None):
+        self.source_file = source_file
+        self.path = snapshot_path(source_file, prepare, snapshot_dir)
+        stat = os.stat(source_file)
+
+        if not self.open((stat.st_mtime_ns, stat.st_size)):
+            build_snapshot(source_file, self.path, prepare)
+            if not self.open((stat.st_mtime_ns, stat.st_size)):
+                raise ValueError(f'could not open snapshot {self.path}')
+
+    def open(self, signature):
+        """
+        maps the snapshot, returns False when it's missing, stale, empty or cut short
+        """
+        if not os.path.exists(self.path) or os.path.getsize(self.path) < HEADER.size:
+            return False
+        try:
+            with open(self.path, 'rb') as infile:
+                self.map = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # emptied since the size check
+            return False
+        try:
+            magic, mtime_ns, size, self.count, _, _, length = HEADER.unpack_from(self.map, 0)
+        except struct.error:
+            magic = None
+        if magic != MAGIC or (mtime_ns, size) != signature or len(self.map) != length:
+            self.close()
+            return False
+        return True
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, _id):
+        return self.find(_id) is not None
+
+    def find(self, _id):
+        """
+        binary search of the entry table, returns the value's (offset, length)
+        """
+        key = str(_id).encode('utf-8')
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            key_offset, key_length, value_offset, value_length = ENTRY.unpack_from(self.map, HEADER.size + middle * ENTRY.size)
+            candidate = self.map[key_offset:key_offset + key_length]
+            if candidate < key:
+                low = middle + 1
+            elif candidate > key:
+                high = middle
+            else:
+                return value_offset, value_length
+        return None
+
+    def get(self, _id, default=None):
+        position = self.find(_id)
+        if position is None:
+            return default
+        offset, length = position
+        return serialization.loads(self.map[offset:offset + length])
+
+    def get_many(self, ids):
+        """
+        returns {_id: annotation} for every id that has an annotation
+        """
+        found = {}
+        for _id in set(ids):
+            record = self.get(_id)
+            if record is not None:
+                found[_id] = record
+        return found
+
+    def close(self):
+        self.map.close()
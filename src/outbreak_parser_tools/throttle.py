@@ -0,0 +1,149 @@
+import time
+import logging
+import threading
+
+from collections import deque
+from statistics  import median
+
+from .logger       import count
+from .safe_request import POOL_MAXSIZE
+
+MIN_PER_PAGE    = 50
+MAX_PER_PAGE    = 1000
+PAGE_STEP       = 100
+MIN_CONCURRENCY = 1
+# past the per-host pool, urllib3 opens connections only to throw them away
+MAX_CONCURRENCY = POOL_MAXSIZE
+WINDOW          = 20
+MAX_BACKOFF     = 60
+# responses that mean the server wants fewer requests, not smaller ones
+THROTTLE_STATUSES = (429, 503)
+
+def response_status(error):
+    response = getattr(error, 'response', None)
+    return getattr(response, 'status_code', None)
+
+def retry_after(error):
+    """
+    seconds from a Retry-After header, if the error's response carries one
+    """
+    response = getattr(error, 'response', None)
+    value = response.headers.get('Retry-After') if response is not None else None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+class AdaptiveController:
+    """
+    AIMD control of page size and request concurrency for one server
+
+    each round of successful requests (as many as are allowed in flight) adds
+    one to the concurrency and page_step to the page size. a 429 or 503 halves
+    the concurrency and pauses new requests for the Retry-After time, or a
+    backoff that doubles with every throttle in a row. any other failure halves
+    the page size, and so does the concurrency once more than max_error_rate of
+    the last `window` requests failed. a request slower than target_latency
+    (by default `slowdown` times the recent median) counts as congestion and
+    halves the concurrency. both stay within their min and max.
+
+    one controller can be shared by every Paginator talking to the same server
+    """
+    def __init__(self, per_page=MAX_PER_PAGE, concurrency=4,
+                 min_per_page=MIN_PER_PAGE, max_per_page=MAX_PER_PAGE, page_step=PAGE_STEP,
+                 min_concurrency=MIN_CONCURRENCY, max_concurrency=MAX_CONCURRENCY,
+                 target_latency=None, slowdown=3.0, window=WINDOW, max_error_rate=0.2,
+                 decrease=0.5, backoff=1.0, max_backoff=MAX_BACKOFF):
+        self.min_per_page    = min_per_page
+        self.max_per_page    = max_per_page
+        self.page_step       = page_step
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.target_latency  = target_latency
+        self.slowdown        = slowdown
+        self.max_error_rate  = max_error_rate
+        self.decrease        = decrease
+        self.backoff         = backoff
+        self.max_backoff     = max_backoff
+        self.lock      = threading.Lock()
+        self.latencies = deque(maxlen=window)
+        self.outcomes  = deque(maxlen=window)
+        self.page_size = min(max(per_page, min_per_page), max_per_page)
+        self.allowed   = min(max(concurrency, min_concurrency), max_concurrency)
+        self.streak    = 0
+        self.throttles = 0
+        self.paused_until = 0.0
+
+    @property
+    def per_page(self):
+        return int(self.page_size)
+
+    @property
+    def concurrency(self):
+        return int(self.allowed)
+
+    @property
+    def error_rate(self):
+        with self.lock:
+            return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+    def congested(self, latency):
+        if self.target_latency is not None:
+            return latency > self.target_latency
+        if len(self.latencies) < 5:
+            return False
+        return latency > self.slowdown * median(self.latencies)
+
+    def shrink_concurrency(self):
+        self.allowed = max(self.min_concurrency, self.allowed * self.decrease)
+        self.streak  = 0
+
+    def shrink_pages(self):
+        self.page_size = max(self.min_per_page, self.page_size * self.decrease)
+        self.streak    = 0
+
+    def success(self, latency):
+        with self.lock:
+            congested = self.congested(latency)
+            self.latencies.append(latency)
+            self.outcomes.append(True)
+            self.throttles = 0
+            if congested:
+                self.shrink_concurrency()
+                return
+            self.streak += 1
+            if self.streak >= self.concurrency:
+                self.allowed   = min(self.max_concurrency, self.allowed + 1)
+                self.page_size = min(self.max_per_page, self.page_size + self.page_step)
+                self.streak    = 0
+
+    def failure(self, error):
+        """
+        records a failed request, returns whether the server was throttling us
+        (in which case the request should be repeated as it was)
+        """
+        with self.lock:
+            self.outcomes.append(False)
+            if response_status(error) in THROTTLE_STATUSES:
+                self.throttles += 1
+                delay = retry_after(error)
+                if delay is None:
+                    delay = min(self.max_backoff, self.backoff * 2 ** (self.throttles - 1))
+                self.paused_until = max(self.paused_until, time.monotonic() + delay)
+                self.shrink_concurrency()
+                throttled = True
+            else:
+                self.shrink_pages()
+                if self.outcomes.count(False) / len(self.outcomes) > self.max_error_rate:
+                    self.shrink_concurrency()
+                throttled = False
+        if throttled:
+            count('http_throttled')
+            logging.warning(f"server is throttling, pausing {delay:.1f}s at concurrency {self.concurrency}")
+        return throttled
+
+    def delay(self):
+        """
+        seconds to wait before starting another request
+        """
+        return max(0.0, self.paused_until - time.monotonic())
@@ -1,22 +1,96 @@
-import biothings
-import requests
+import os
+import json
+import time
+import logging
 
-def create_uploader(upload_config, parser_func):
-    uploader_name = f"{upload_config['name'].capitalize()}Uploader"
-    
-    def get_mapping(klass):
-        r = requests.get(upload_config['map'])
+from .      import safe_request
+from .utils import chunked
+
+BATCH_SIZE  = 10000
+MAPPING_TTL = 24 * 60 * 60
+
+def read_mapping_cache(path):
+    try:
+        with open(path, 'r') as infile:
+            return json.load(infile)
+    except (OSError, ValueError):
+        return None
+
+def write_mapping_cache(path, mapping):
+    temp_file = f'{path}.{os.getpid()}.tmp'
+    with open(temp_file, 'w') as outfile:
+        json.dump(mapping, outfile)
+    os.replace(temp_file, path)
+
+def fetch_mapping(url, cache_file, ttl=MAPPING_TTL):
+    """
+    the mapping at url, served from cache_file while it is younger than ttl
+    and used as the fallback whenever the fetch fails
+    """
+    if os.path.exists(cache_file) and time.time() - os.path.getmtime(cache_file) < ttl:
+        mapping = read_mapping_cache(cache_file)
+        if mapping is not None:
+            return mapping
+
+    try:
+        r = safe_request.get(url)
         if (r.status_code == 200):
             mapping = r.json()
-            mapping_dict = {key: mapping[key] for key in MAP_VARS}
-            return mapping_dict
+            write_mapping_cache(cache_file, mapping)
+            return mapping
+        logging.error(f'failed to get mapping {url}: {r.status_code}')
+    except Exception as requestException:
+        logging.error(f'failed to get mapping {url} due to {requestException}')
+
+    logging.warning(f'using cached mapping {cache_file}')
+    return read_mapping_cache(cache_file)
+
+def create_uploader(upload_config, parser_func, annotator=None, batch_size=BATCH_SIZE):
+    """
+    builds a BaseSourceUploader subclass for a parser
+
+    documents are pulled from parser_func() batch_size at a time; annotator,
+    a factory such as Addendum.composite_adder, is called once per upload and
+    its annotator applied to each batch before it goes to storage, which
+    writes with the same batch size.
+    the mapping is cached in upload_config['map_cache'] (default <name>_mapping.json)
+    """
+    # biothings is heavy to import and only needed once an uploader is built
+    import biothings.hub.dataload.uploader
+    import biothings.hub.dataload.storage
+
+    uploader_name = f"{upload_config['name'].capitalize()}Uploader"
+    base_class    = biothings.hub.dataload.uploader.BaseSourceUploader
+    cache_file    = upload_config.get('map_cache', f"{upload_config['name']}_mapping.json")
+
+    def get_mapping(klass):
+        mapping = fetch_mapping(upload_config['map'], cache_file, upload_config.get('map_ttl', MAPPING_TTL))
+        if mapping is None:
+            return None
+        mapping_vars = upload_config.get('vars', mapping.keys())
+        mapping_dict = {key: mapping[key] for key in mapping_vars}
+        return mapping_dict
+
+    def load_data(self, data_folder):
+        adder = annotator() if annotator else None
+        for batch in chunked(parser_func(), batch_size):
+            if adder:
+                adder.update(batch)
+            yield from batch
+
+    def load(self, *args, **kwargs):
+        # batch_size is load's third positional argument
+        if len(args) < 3:
+            kwargs.setdefault('batch_size', batch_size)
+        return base_class.load(self, *args, **kwargs)
 
-    return type(uploader_name, (biothings.hub.dataload.uploader.BaseSourceUploader,), {
+    return type(uploader_name, (base_class,), {
         'main_source':   upload_config['name'],
         'name':          upload_config['name'],
         '__metadata__':  upload_config['metadata'],
         'idconverter':   None,
-        'storage_class': biothings.hub.dataload.storage.BasicStorage,
-        'get_mapping':   classmethod(get_mapping)
-        'load_data':     lambda x, y: parser_func(),
+        'storage_class': upload_config.get('storage_class', biothings.hub.dataload.storage.BasicStorage),
+        'get_mapping':   classmethod(get_mapping),
+        'load_data':     load_data,
+        'load':          load,
     })
@@ -0,0 +1,12 @@
+from itertools import islice
+
+def chunked(iterable, size):
+    """
+    yields lists of up to size items from any iterable, without reading ahead
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
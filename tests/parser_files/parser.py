@@ -1,35 +1,26 @@
-import requests
-from requests.adapters import HTTPAdapter
-from requests.packages.urllib3.util.retry import Retry
+import sys
 import json
 
 from datetime    import date
+from itertools   import chain
 from html.parser import HTMLParser
 
-def requests_retry_session(retries=3, backoff_factor=0.3, status_forcelist=(500, 502, 504), session=None):
-    """
-    request backoff + retry helper
-    https://www.peterbe.com/plog/best-practice-with-retries-with-requests
-    """
+from outbreak_parser_tools           import columnar, safe_request, serialization
+from outbreak_parser_tools.dedup     import Deduplicator
+from outbreak_parser_tools.logger    import get_logger
+from outbreak_parser_tools.paginator import Paginator
+from outbreak_parser_tools.parallel  import fetch_and_transform
+from outbreak_parser_tools.throttle  import AdaptiveController
+
+logger = get_logger('dataverses')
 
-    session = session or requests.Session()
-    retry = Retry(
-            total=retries,
-            read=retries,
-            connect=retries,
-            backoff_factor=backoff_factor,
-            status_forcelist=status_forcelist,
-            )
-    adapter = HTTPAdapter(max_retries=retry)
-    session.mount('http://', adapter)
-    session.mount('https://', adapter)
-    return session
- 
 QUERIES = ["2019-nCoV", "COVID-19", "COVID19", "SARS-2", "SARS-CoV-2", "SARS2", "coronavirus disease", "novel coronavirus"]
 TIMEOUT = 300
 
 DATAVERSE_SERVER = "https://dataverse.harvard.edu/api/"
 EXPORT_URL = f"{DATAVERSE_SERVER}datasets/export?exporter=schema.org"
+# every search against the server shares one page size / concurrency controller
+CONTROLLER = AdaptiveController()
 
 def compile_query(server, queries=None, response_types=None, subtrees=None):
     """
@@ -66,36 +57,7 @@ def compile_paginated_data(query_endpoint, per_page=1000):
     and returning them.
     per_page max is 1000
     """
-
-    continue_paging = True
-    start   = 0
-    data    = []
-    retries = 0
-
-    while continue_paging:
-        url = f"{query_endpoint}&per_page={per_page}&start={start}"
-        logger.info(f"getting {url}")
-        try:
-            req = requests_retry_session().get(url, timeout=TIMEOUT)
-        except Exception as requestException:
-            logger.error(f"Failed to get {url} due to {requestException}")
-            if retries > 5:
-                logger.error("Failed too many times")
-                return data
-            retries += 1
-            # after 1 retry, limit per-page to 200, after 2, limit to 50
-            per_page = 200 if retries == 1 else 50
-            continue
-        try:
-            response = req.json()
-        except ValueError:
-            logger.error(f"Failed to get a JSON response from {url}")
-        total = response.get('data').get('total_count')
-        data.extend(response.get('data').get('items'))
-        start += per_page
-        continue_paging = total and start < total
-
-    return data
+    return list(Paginator(query_endpoint, per_page=per_page, timeout=TIMEOUT, controller=CONTROLLER))
 
 def find_relevant_dataverses(query):
     """
@@ -111,6 +73,7 @@ def find_within_dataverse(dataverse_id, query):
     """
     searches for query within a specific dataverse
     or can group all dataverse IDs into a singular batch of requests
+    yields results as their pages arrive
     """
 
     response_types = ["dataset", "file"]
@@ -118,19 +81,18 @@ def find_within_dataverse(dataverse_id, query):
             query,
             response_types=response_types,
             subtrees=[dataverse_id])
-    datasets_and_files = compile_paginated_data(query_endpoint, per_page=1000)
-    return datasets_and_files
+    yield from Paginator(query_endpoint, per_page=1000, timeout=TIMEOUT, controller=CONTROLLER)
 
-def get_all_datasets_from_dataverses():
+def iter_datasets_from_dataverses():
     logger.info("finding all dataverses that match for queries")
     dataverses = find_relevant_dataverses(QUERIES)
 
     logger.info("grabbing datasets from each matched dataverse")
-    datasets = []
     for dataverse in dataverses:
-        datasets.extend(find_within_dataverse(dataverse, query=None))
+        yield from find_within_dataverse(dataverse, query=None)
 
-    return datasets
+def get_all_datasets_from_dataverses():
+    return list(iter_datasets_from_dataverses())
 
 def scrape_schema_representation(url):
     """
@@ -155,7 +117,7 @@ def scrape_schema_representation(url):
                 self.readingSchema = False
 
     try:
-        req = requests_retry_session().get(url, timeout=TIMEOUT)
+        req = safe_request.get(url, timeout=TIMEOUT)
     except Exception as requestException:
         logger.error(f"Failed to get {url} due to {requestException}")
         return False
@@ -168,6 +130,24 @@ def scrape_schema_representation(url):
         return parser.schema
     return False
 
+def iter_datasets():
+    """
+    streams all datasets and files related to QUERIES both by querying
+    and by grabbing everything in related dataverses,
+    yielding each global_id (a DOI) once as the pages arrive.
+    the dataverse listings go first so their copy of a dataset wins,
+    as it did when the two were merged into one dict
+    """
+
+    def query_results():
+        logger.info("getting all datasets that match queries")
+        for query in QUERIES:
+            dataset_endpoint = compile_query(DATAVERSE_SERVER, query, response_types=["dataset", "file"])
+            yield from Paginator(dataset_endpoint, timeout=TIMEOUT, controller=CONTROLLER)
+
+    deduplicator = Deduplicator(key='global_id')
+    yield from deduplicator.unique(chain(iter_datasets_from_dataverses(), query_results()))
+
 def fetch_datasets():
     """
     grabs all datasets and files related to QUERIES both by querying
@@ -175,45 +155,14 @@ def fetch_datasets():
     extracts their global_id, which in this case is a DOI
     returns a dictionary mapping global_id -> dataset
     """
-
-    logger.info("getting all datasets that match queries")
-
-    dataset_ids = set([None])
-    datasets    = []
-
-    for query in QUERIES:
-        dataset_endpoint    = compile_query(DATAVERSE_SERVER, query, response_types=["dataset", "file"])
-        new_datasets        = compile_paginated_data(dataset_endpoint)
-        unique_new_datasets = [i for i in new_datasets if i.get('global_id') not in dataset_ids]
-        datasets.extend(unique_new_datasets)
-
-        # union-equals instead of += for sets
-        dataset_ids        |= set([i.get('global_id') for i in unique_new_datasets])
-
-    data_for_gid = {d.get('global_id'): d for d in datasets}
-    schema_org_exports = {}
-
-    additional_datasets = get_all_datasets_from_dataverses()
-    additional_data_for_gid = {d.get('global_id'): d for d in additional_datasets}
-
-    total_datasets = {
-            **data_for_gid,
-            **additional_data_for_gid
-    }
-
-    try:
-        total_datasets.pop('')
-    except KeyError:
-        pass
-
-    return total_datasets
+    return {d.get('global_id'): d for d in iter_datasets()}
 
 
 def get_schema(gid, url):
     schema_export_url = f"{EXPORT_URL}&persistentId={gid}"
     logger.info(f"getting schema {url}")
     try:
-        req = requests_retry_session().get(schema_export_url, timeout=TIMEOUT)
+        req = safe_request.get(schema_export_url, timeout=TIMEOUT)
     except Exception as requestException:
         logger.error(f"Failed to get {url} due to {requestException}")
         return False
@@ -292,15 +241,13 @@ def add_field(resource, origin, field_name):
     return resource
 
 def load_annotations():
-    datasets = fetch_datasets()
-    for gid, dataset in datasets.items():
-        schema = get_schema(gid, dataset.get('url'))
-        if not schema:
-            continue
-
-        transformed = transform_schema(schema, gid)
+    jobs = ((dataset.get('global_id'), dataset.get('url')) for dataset in iter_datasets())
+    for gid, transformed in fetch_and_transform(jobs, fetch=get_schema, transform=transform_schema):
         yield transformed
 
 if __name__ == "__main__":
-    with open('transformed.json', 'w') as output:
-        json.dump([i for i in load_annotations()], output)
+    destination = sys.argv[1] if len(sys.argv) > 1 else 'transformed.json'
+    if destination.endswith(('.parquet', '.arrow')):
+        columnar.write_columnar(load_annotations(), destination)
+    else:
+        serialization.write_json_array(load_annotations(), destination)
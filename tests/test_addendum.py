@@ -0,0 +1,303 @@
+import os
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+
+from outbreak_parser_tools import addendum
+from outbreak_parser_tools.annotation_store import AnnotationStore
+from outbreak_parser_tools.external         import external_sort
+from outbreak_parser_tools.serialization    import iter_json_array
+from outbreak_parser_tools.snapshot         import AnnotationSnapshot
+
+CORRECTIONS = [
+    {"_id": "pmid32525881", "correction": [{"@type": "Correction", "identifier": "2020.03.31.20048876", "url": "https://doi.org/10.1101/2020.03.31.20048876"}]},
+    {"_id": "pmid32485157", "correction": [{"@type": "Correction", "identifier": "2020.05.22.20106328", "url": "https://doi.org/10.1101/2020.05.22.20106328"}]},
+]
+TOPICS = [
+    {"_id": "199059",            "topicCategory": "['Mechanism', 'Treatment']"},
+    {"_id": "2020.01.20.913368", "topicCategory": "['Mechanism', 'Transmission', 'Treatment']"},
+    {"_id": "2020.01.21.914044", "topicCategory": "['Mechanism', 'Transmission']"},
+]
+METRICS = [
+    {"_id": "199059", "evaluations": [{"@type": "Rating", "name": "altmetric", "ratingValue": 3.5, "reviewAspect": "Altmetric score"}]},
+]
+
+def make_documents():
+    return [
+        {"_id": "pmid32525881",      "name": "Japanese countermeasures"},
+        {"_id": "2020.01.20.913368", "name": "genomic analysis of a new coronavirus"},
+        {"_id": "199059",            "name": "mechanisms", "evaluations": [{"@type": "Rating", "name": "citations"}]},
+        {"_id": "unannotated",       "name": "nothing to add"},
+    ]
+
+class AnnotationTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.files = {
+            'corrections': self.write('corrections.json', CORRECTIONS),
+            'topics':      self.write('topics.json', TOPICS),
+            'metrics':     self.write('metrics.json', METRICS),
+        }
+
+    def tearDown(self):
+        addendum.clear_loaded()
+        shutil.rmtree(self.directory)
+
+    def write(self, name, records, indent=None):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as outfile:
+            json.dump(records, outfile, indent=indent)
+        return path
+
+class TestAnnotationStore(AnnotationTestCase):
+    def test_iter_json_array_offsets(self):
+        records = TOPICS + [{"_id": "unicode", "name": "Ünïcødé ☃"}]
+        path = self.write('pretty.json', records, indent=2)
+        with open(path, 'rb') as infile:
+            raw = infile.read()
+        seen = []
+        for offset, length, record in iter_json_array(path, chunk_size=16):
+            self.assertEqual(json.loads(raw[offset:offset + length]), record)
+            seen.append(record)
+        self.assertEqual(seen, records)
+
+    def test_lookup_matches_memory(self):
+        documents = make_documents()
+        memory  = addendum.Correction(self.files['corrections'])
+        indexed = addendum.Correction(self.files['corrections'], backend='index')
+        self.assertEqual(memory.relevant_annotation_dict(documents),
+                         indexed.relevant_annotation_dict(documents))
+        self.assertEqual(len(indexed.store), len(CORRECTIONS))
+
+    def test_used_from_another_thread(self):
+        store = AnnotationStore(self.files['corrections'])
+        found = []
+        thread = threading.Thread(target=lambda: found.append(store.get_many(['pmid32525881', 'missing'])))
+        thread.start()
+        thread.join()
+        self.assertEqual(list(found[0]), ['pmid32525881'])
+        store.close()
+
+    def test_index_rebuilt_when_source_changes(self):
+        store = AnnotationStore(self.files['topics'])
+        self.assertIn('199059', store)
+        store.close()
+
+        self.write('topics.json', TOPICS[1:] + [{"_id": "new", "topicCategory": "['Testing']"}])
+        store = AnnotationStore(self.files['topics'])
+        self.assertNotIn('199059', store)
+        self.assertEqual(store.get('new')['topicCategory'], "['Testing']")
+        store.close()
+
+class TestAnnotationSnapshot(AnnotationTestCase):
+    def test_snapshot_stores_prepared_values(self):
+        topic = addendum.Topic(self.files['topics'], backend='snapshot')
+        self.assertEqual(topic.store.get('2020.01.21.914044')['topicCategory'], ['Mechanism', 'Transmission'])
+        self.assertIsNone(topic.store.get('missing'))
+        self.assertEqual(len(topic.store), len(TOPICS))
+
+    def test_backends_agree(self):
+        for backend in ('memory', 'index', 'snapshot'):
+            documents = make_documents()
+            addendum.Correction(self.files['corrections'], backend=backend).update(documents)
+            addendum.Topic(self.files['topics'], backend=backend).update(documents)
+            addendum.Metric(self.files['metrics'], backend=backend).update(documents)
+            if backend == 'memory':
+                expected = documents
+            self.assertEqual(documents, expected, backend)
+
+    def test_snapshot_invalidated_when_source_changes(self):
+        snapshot = AnnotationSnapshot(self.files['metrics'])
+        self.assertIn('199059', snapshot)
+        snapshot.close()
+
+        self.write('metrics.json', [{"_id": "other", "evaluations": []}])
+        snapshot = AnnotationSnapshot(self.files['metrics'])
+        self.assertNotIn('199059', snapshot)
+        self.assertIn('other', snapshot)
+        snapshot.close()
+
+    def test_damaged_snapshot_rebuilt(self):
+        snapshot = AnnotationSnapshot(self.files['topics'])
+        path = snapshot.path
+        snapshot.close()
+        with open(path, 'rb') as infile:
+            built = infile.read()
+
+        for damaged in (b'', built[:20], built[:100], built[:-30]):
+            with open(path, 'wb') as outfile:
+                outfile.write(damaged)
+            snapshot = AnnotationSnapshot(self.files['topics'])
+            self.assertEqual(len(snapshot), len(TOPICS))
+            self.assertEqual(snapshot.get_many([t['_id'] for t in TOPICS]), {t['_id']: t for t in TOPICS})
+            snapshot.close()
+
+class TestTopicNormalisation(AnnotationTestCase):
+    def test_parse_is_shared(self):
+        first  = addendum.parse_topic_category("['Mechanism', 'Treatment']")
+        second = addendum.parse_topic_category("['Mechanism', 'Treatment']")
+        self.assertEqual(first, ('Mechanism', 'Treatment'))
+        self.assertIs(first, second)
+
+    def test_normalised_file_gives_same_topics(self):
+        normalised = os.path.join(self.directory, 'normalised.json')
+        addendum.normalise_topics_file(self.files['topics'], normalised)
+        with open(normalised) as infile:
+            self.assertEqual(json.load(infile)[0]['topicCategory'], ['Mechanism', 'Treatment'])
+
+        expected  = make_documents()
+        documents = make_documents()
+        addendum.Topic(self.files['topics']).update(expected)
+        addendum.Topic(normalised).update(documents)
+        self.assertEqual(documents, expected)
+
+class TestUpdate(AnnotationTestCase):
+    def test_update(self):
+        documents = make_documents()
+        addendum.Correction(self.files['corrections']).update(documents)
+        addendum.Topic(self.files['topics']).update(documents)
+        addendum.Metric(self.files['metrics']).update(documents)
+
+        self.assertEqual(documents[0]['correction'][0]['identifier'], "2020.03.31.20048876")
+        self.assertEqual(documents[1]['topicCategory'], ['Mechanism', 'Transmission', 'Treatment'])
+        self.assertEqual([e['name'] for e in documents[2]['evaluations']], ['citations', 'altmetric'])
+        self.assertEqual(documents[3], {"_id": "unannotated", "name": "nothing to add"})
+
+    def test_memory_lookup_is_keyed(self):
+        topic = addendum.Topic(self.files['topics'])
+        self.assertEqual(sorted(topic.annotations), sorted(t['_id'] for t in TOPICS))
+        self.assertEqual(list(topic.lookup({'199059', 'missing'})), ['199059'])
+
+    def test_stream_is_lazy(self):
+        produced = []
+        def load_annotations():
+            for document in make_documents():
+                produced.append(document['_id'])
+                yield document
+
+        stream = addendum.Topic(self.files['topics']).stream(load_annotations(), chunk_size=2)
+        first = next(stream)
+        self.assertEqual(len(produced), 2)
+        results = [first] + list(stream)
+
+        expected = make_documents()
+        addendum.Topic(self.files['topics']).update(expected)
+        self.assertEqual(results, expected)
+
+    def test_composite_single_pass(self):
+        documents = make_documents()
+        composite = addendum.CompositeAnnotation({
+            'corrections': addendum.Correction(self.files['corrections']),
+            'topics':      addendum.Topic(self.files['topics']),
+            'altmetrics':  addendum.Metric(self.files['metrics']),
+        })
+        composite.update(documents)
+
+        expected = make_documents()
+        addendum.Correction(self.files['corrections']).update(expected)
+        addendum.Topic(self.files['topics']).update(expected)
+        addendum.Metric(self.files['metrics']).update(expected)
+
+        self.assertEqual(documents, expected)
+        self.assertEqual(composite.hits, {'corrections': 1, 'topics': 2, 'altmetrics': 1})
+
+    def test_same_upload_twice(self):
+        # a second source for the same ids appends to what the first one attached
+        litcovid = self.write('litcovid.json', [{"_id": "pmid32525881", "correction": [{"@type": "Correction", "identifier": "lit"}]}])
+        altmetric = self.write('altmetric.json', [{"_id": "199059", "evaluations": [{"@type": "Rating", "name": "other"}]}])
+        for backend in ('memory', 'index', 'snapshot'):
+            annotators = [addendum.Correction(self.files['corrections'], backend=backend), addendum.Correction(litcovid, backend=backend),
+                          addendum.Metric(self.files['metrics'], backend=backend), addendum.Metric(altmetric, backend=backend)]
+            results = []
+            for upload in range(3):
+                documents = make_documents()
+                del documents[2]['evaluations']
+                for annotator in annotators:
+                    annotator.update(documents)
+                results.append(documents)
+            self.assertEqual(len(results[0][0]['correction']), 2, backend)
+            self.assertEqual(len(results[0][2]['evaluations']), 2, backend)
+            self.assertEqual(results[1], results[0], backend)
+            self.assertEqual(results[2], results[0], backend)
+
+class TestLazyLoading(AnnotationTestCase):
+    def test_nothing_read_until_there_are_ids(self):
+        topic = addendum.Topic(os.path.join(self.directory, 'missing.json'))
+        topic.update([])
+        with self.assertRaises(FileNotFoundError):
+            topic.update(make_documents())
+
+    def test_loaded_once_per_file_version(self):
+        first  = addendum.Topic(self.files['topics'], backend='index')
+        second = addendum.Topic(self.files['topics'], backend='index')
+        self.assertIs(first.store, second.store)
+        self.assertIsNot(first.store, addendum.Topic(self.files['topics'], backend='snapshot').store)
+
+        self.write('topics.json', TOPICS[:1])
+        os.utime(self.files['topics'], ns=(0, 0))
+        self.assertEqual(len(second.store), 1)
+        self.assertIs(first.store, second.store)
+
+    def test_shared_store_used_from_another_thread(self):
+        for backend in ('index', 'snapshot'):
+            addendum.Topic(self.files['topics'], backend=backend).load()
+            documents = make_documents()
+            worker = threading.Thread(target=addendum.Topic(self.files['topics'], backend=backend).update, args=(documents,))
+            worker.start()
+            worker.join()
+            self.assertEqual(documents[1]['topicCategory'], ['Mechanism', 'Transmission', 'Treatment'], backend)
+
+    def test_store_dir(self):
+        store_dir = os.path.join(self.directory, 'stores')
+        os.mkdir(store_dir)
+        for backend in ('index', 'snapshot'):
+            documents = make_documents()
+            addendum.Topic(self.files['topics'], backend=backend, store_dir=store_dir).update(documents)
+            self.assertEqual(documents[1]['topicCategory'], ['Mechanism', 'Transmission', 'Treatment'], backend)
+        self.assertEqual(len(os.listdir(store_dir)), 2)
+        self.assertEqual(sorted(os.listdir(self.directory)), ['corrections.json', 'metrics.json', 'stores', 'topics.json'])
+
+class TestJoin(AnnotationTestCase):
+    def by_id(self, documents):
+        return sorted(documents, key=lambda d: d['_id'])
+
+    def test_join_matches_update(self):
+        for annotator, source in ((addendum.Correction, 'corrections'), (addendum.Topic, 'topics'), (addendum.Metric, 'metrics')):
+            expected = make_documents()
+            annotator(self.files[source]).update(expected)
+            joined = annotator(self.files[source], backend='external').join(make_documents(), run_size=2)
+            self.assertEqual(list(joined), self.by_id(expected), source)
+
+    def test_composite_join_matches_update(self):
+        composite = addendum.CompositeAnnotation({
+            'corrections': addendum.Correction(self.files['corrections'], backend='external'),
+            'topics':      addendum.Topic(self.files['topics'], backend='external'),
+            'altmetrics':  addendum.Metric(self.files['metrics'], backend='external'),
+        })
+        joined = list(composite.join(make_documents(), run_size=1, directory=self.directory))
+
+        expected = make_documents()
+        composite.update(expected)
+        self.assertEqual(joined, self.by_id(expected))
+        self.assertEqual(composite.hits, {'corrections': 2, 'topics': 4, 'altmetrics': 2})
+        self.assertEqual(sorted(os.listdir(self.directory)), ['corrections.json', 'metrics.json', 'topics.json'])
+
+    def test_later_duplicate_wins(self):
+        path = self.write('duplicates.json', [{"_id": "199059", "topicCategory": "['Mechanism']"},
+                                              {"_id": "199059", "topicCategory": "['Treatment']"}])
+        joined = list(addendum.Topic(path, backend='external').join(make_documents(), run_size=1))
+        expected = make_documents()
+        addendum.Topic(path).update(expected)
+        self.assertEqual(joined, self.by_id(expected))
+        self.assertEqual(expected[2]['topicCategory'], ['Treatment'])
+
+    def test_external_sort_merges_in_passes(self):
+        records = [{"_id": f"{i * 7919 % 100:03d}", "run": i} for i in range(100)]
+        self.assertEqual(list(external_sort(records, self.directory, run_size=3, fan_in=2)),
+                         sorted(records, key=lambda r: r['_id']))
+        self.assertLessEqual(len([f for f in os.listdir(self.directory) if f.endswith('.ndjson')]), 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+from functools import partial
+
+import requests
+
+from outbreak_parser_tools.cassette     import Cassette, CassetteMiss, RecordingAdapter, ReplayAdapter
+from outbreak_parser_tools.safe_request import SessionManager
+
+from test_safe_request import StubServerTestCase
+
+class TestCassette(StubServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.cassette  = Cassette(os.path.join(self.directory, 'cassette.sqlite'))
+        self.urls = [f'{self.base}/export/{i}' for i in range(10)]
+
+        manager = SessionManager(adapter=partial(RecordingAdapter, self.cassette))
+        self.recorded = [r.text for r in manager.get_many(self.urls)]
+        manager.close()
+        # nothing below reaches the server
+        self.server.shutdown()
+
+    def tearDown(self):
+        self.cassette.close()
+        super().tearDown()
+        shutil.rmtree(self.directory)
+
+    def replay(self, retries=0, **kwargs):
+        return SessionManager(retries=retries, backoff_factor=0, adapter=partial(ReplayAdapter, self.cassette, **kwargs))
+
+    def test_replays_what_was_recorded(self):
+        self.assertEqual(len(self.cassette), 10)
+        manager = self.replay()
+        responses = manager.get_many(self.urls)
+        self.assertEqual([r.text for r in responses], self.recorded)
+        self.assertEqual(responses[0].headers['ETag'], '"1"')
+        with self.assertRaises(CassetteMiss):
+            manager.get(f'{self.base}/never')
+
+    def test_latency(self):
+        start = time.perf_counter()
+        self.replay(latency=0.05, jitter=0.01).get(self.urls[0])
+        self.assertGreaterEqual(time.perf_counter() - start, 0.05)
+        with self.assertRaises(requests.exceptions.ReadTimeout):
+            self.replay(latency=0.05).get(self.urls[0], timeout=0.01)
+
+    def test_failures_are_reproducible(self):
+        def statuses(manager):
+            return [manager.get(url).status_code for url in self.urls * 3]
+
+        first = statuses(self.replay(failure_rate=0.5, seed=7))
+        self.assertEqual(statuses(self.replay(failure_rate=0.5, seed=7)), first)
+        self.assertEqual(set(first), {200, 503})
+        self.assertNotEqual(statuses(self.replay(failure_rate=0.5, seed=8)), first)
+
+    def test_injected_failures_are_retried(self):
+        # the urls carry the stub's port, so the draws change from run to run;
+        # 21 failures in a row for one url is what would make this flaky
+        manager = self.replay(retries=20, failure_rate=0.3, failure_statuses=(502,), seed=1)
+        self.assertEqual([manager.get(url).text for url in self.urls], self.recorded)
+
+        manager = self.replay(retries=1, failure_rate=1.0, failure_statuses=(502,))
+        with self.assertRaises(requests.exceptions.RetryError):
+            manager.get(self.urls[0])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import shutil
+import tempfile
+import unittest
+
+from itertools import islice
+
+from outbreak_parser_tools.checkpoint import Checkpoint
+from outbreak_parser_tools.paginator  import IncompleteHarvest, Paginator
+
+from test_paginator import PaginatorTestCase
+
+class TestCheckpoint(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_half_written_record_is_dropped(self):
+        checkpoint = Checkpoint(self.directory)
+        checkpoint.add('doi:1', {'name': 'one'})
+        checkpoint.add('doi:2', {'name': 'two'})
+        checkpoint.close()
+        with open(checkpoint.spill_file, 'ab') as outfile:
+            outfile.write(b'{"id": "doi:3", "rec')
+
+        checkpoint = Checkpoint(self.directory)
+        self.assertTrue(checkpoint.is_done('doi:2'))
+        self.assertFalse(checkpoint.is_done('doi:3'))
+        checkpoint.add('doi:3', {'name': 'three'})
+        self.assertEqual([r['name'] for r in checkpoint.records()], ['one', 'two', 'three'])
+        checkpoint.complete()
+        self.assertFalse(Checkpoint(self.directory).is_done('doi:1'))
+
+    def test_unfinished_items_come_back(self):
+        checkpoint = Checkpoint(self.directory, save_every=1)
+        checkpoint.track('doi:1', {'global_id': 'doi:1'})
+        checkpoint.track('doi:2', {'global_id': 'doi:2'})
+        checkpoint.add('doi:1', {'name': 'one'})
+
+        checkpoint = Checkpoint(self.directory)
+        self.assertTrue(checkpoint.is_done('doi:2'))
+        self.assertEqual(checkpoint.pending_items(), [{'global_id': 'doi:2'}])
+        self.assertFalse(checkpoint.is_done('doi:2'))
+
+class TestCheckpointedPaginator(PaginatorTestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self.directory)
+
+    def test_resumes_from_last_consumed_page(self):
+        checkpoint = Checkpoint(self.directory, save_every=1)
+        # the offset moves on once the page after the third is asked for
+        first = list(islice(Paginator(self.endpoint, per_page=100, checkpoint=checkpoint), 301))
+        self.assertEqual(first, self.server.items[:301])
+
+        checkpoint = Checkpoint(self.directory, save_every=1)
+        self.assertEqual(checkpoint.offset(self.endpoint), 300)
+        self.server.requests = []
+        rest = list(Paginator(self.endpoint, per_page=100, checkpoint=checkpoint))
+        self.assertEqual(rest, self.server.items[300:])
+        self.assertEqual(min(start for start, _ in self.server.requests), 300)
+
+        self.server.requests = []
+        self.assertEqual(list(Paginator(self.endpoint, per_page=100, checkpoint=checkpoint)), [])
+        self.assertEqual(self.server.requests, [])
+
+    def test_giving_up_marks_run_incomplete(self):
+        self.server.broken = {0}
+        checkpoint = Checkpoint(self.directory)
+        with self.assertRaises(IncompleteHarvest):
+            list(Paginator(self.endpoint, per_page=100, max_retries=0, checkpoint=checkpoint))
+        self.assertIn('offset 0', Checkpoint(self.directory).incomplete)
+
+if __name__ == '__main__':
+    unittest.main()
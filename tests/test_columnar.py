@@ -0,0 +1,61 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from outbreak_parser_tools import columnar
+
+def make_documents(size):
+    for i in range(size):
+        document = {
+            "_id": f"dataverse{i}",
+            "@type": "Dataset",
+            "name": f"dataset {i}",
+            "author": [{"@type": "Person", "name": f"Author {j}", "affiliation": {"name": "Scripps"}} for j in range(i % 3)],
+            "curatedBy": {"@type": "Organization", "name": "Harvard Dataverse", "curationDate": "2021-03-01"},
+            "version": i,
+        }
+        if i % 4 == 0:
+            document["evaluations"] = [{"@type": "Rating", "name": "altmetric", "ratingValue": i / 4}]
+        if i == 7:
+            document["version"] = "7.1"           # doesn't fit the inferred int column
+            document["description"] = None        # an explicit null
+        if i == 15:
+            document["keywords"] = ["COVID-19"]   # not a column of the file at all
+        yield document
+
+@unittest.skipIf(columnar.pyarrow is None, 'pyarrow is not installed')
+class TestColumnar(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        for name in ('documents.parquet', 'documents.arrow'):
+            path = os.path.join(self.directory, name)
+            self.assertEqual(columnar.write_columnar(make_documents(25), path, row_group_size=8), 25)
+            self.assertEqual(list(columnar.iter_columnar(path, batch_size=5)), list(make_documents(25)), name)
+
+    def test_reads_only_some_columns(self):
+        path = os.path.join(self.directory, 'documents.parquet')
+        columnar.write_columnar(make_documents(25), path, row_group_size=8)
+        records = list(columnar.iter_columnar(path, columns=['_id', 'version']))
+        self.assertEqual(records[7], {'_id': 'dataverse7', 'version': '7.1'})
+        self.assertEqual(records[15], {'_id': 'dataverse15', 'version': 15})
+
+    def test_nested_fields_are_json_columns(self):
+        path = os.path.join(self.directory, 'documents.parquet')
+        columnar.write_columnar(make_documents(7), path)
+        schema = columnar.pyarrow.parquet.read_schema(path)
+        self.assertEqual(str(schema.field('version').type), 'int64')
+        self.assertEqual(str(schema.field('author').type), 'string')
+
+    def test_empty(self):
+        path = os.path.join(self.directory, 'empty.parquet')
+        self.assertEqual(columnar.write_columnar([], path), 0)
+        self.assertEqual(list(columnar.iter_columnar(path)), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+import unittest
+
+from outbreak_parser_tools.dedup import BloomFilter, Deduplicator
+
+class TestDeduplicator(unittest.TestCase):
+    def test_bloom_has_no_false_negatives(self):
+        bloom = BloomFilter(1000, error_rate=0.01)
+        for i in range(1000):
+            bloom.add(f'doi:{i}')
+        self.assertTrue(all(f'doi:{i}' in bloom for i in range(1000)))
+        false_positives = sum(f'other:{i}' in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+    def test_unique_streams_first_occurrence(self):
+        pages = [[{'global_id': 'doi:1', 'page': 1}, {'global_id': 'doi:2', 'page': 1}, {'global_id': ''}],
+                 [{'global_id': 'doi:2', 'page': 2}, {'global_id': None}, {'global_id': 'doi:3', 'page': 2}]]
+        for capacity in (None, 10):
+            deduplicator = Deduplicator(capacity=capacity)
+            items = list(deduplicator.unique(item for page in pages for item in page))
+            self.assertEqual([(i['global_id'], i['page']) for i in items], [('doi:1', 1), ('doi:2', 1), ('doi:3', 2)])
+            self.assertEqual(deduplicator.duplicates, 1)
+            self.assertEqual(len(deduplicator), 3)
+            deduplicator.close()
+
+    def test_exact_despite_false_positives(self):
+        # a tiny filter answers "maybe seen" for almost everything
+        deduplicator = Deduplicator(key='_id', capacity=8, error_rate=0.5)
+        ids = [f'doi:{i % 300}' for i in range(600)]
+        items = list(deduplicator.unique({'_id': _id} for _id in ids))
+        self.assertEqual([i['_id'] for i in items], [f'doi:{i}' for i in range(300)])
+        self.assertEqual(deduplicator.duplicates, 300)
+        self.assertNotIsInstance(deduplicator.seen, set)
+        deduplicator.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from outbreak_parser_tools.incremental import FingerprintIndex, HarvestState, fingerprint
+
+def harvest(*pairs):
+    return [{'global_id': gid, 'dateModified': modified} for gid, modified in pairs]
+
+class TestHarvestState(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'state.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_only_changes_pass_through(self):
+        state = HarvestState(self.path)
+        first = harvest(('doi:1', '2021-01-01'), ('doi:2', '2021-01-01'), ('doi:3', '2021-01-01'))
+        self.assertEqual(list(state.changed(first)), first)
+        state.commit()
+
+        state = HarvestState(self.path)
+        self.assertIsNotNone(state.last_run)
+        second = harvest(('doi:1', '2021-01-01'), ('doi:2', '2021-02-01'), ('doi:4', '2021-02-01'))
+        self.assertEqual([i['global_id'] for i in state.changed(second)], ['doi:2', 'doi:4'])
+        self.assertEqual(list(state.tombstones(lambda gid: gid.replace('doi:', 'dataverse'))),
+                         [{'_id': 'dataverse3', '_deleted': True}])
+
+    def test_uncommitted_run_is_redone(self):
+        state = HarvestState(self.path)
+        items = harvest(('doi:1', '2021-01-01'), ('doi:2', '2021-01-01'))
+        list(state.changed(items))
+        state.discard('doi:2')
+        state.commit()
+
+        state = HarvestState(self.path)
+        self.assertEqual([i['global_id'] for i in state.changed(items)], ['doi:2'])
+        self.assertEqual(list(state.tombstones()), [])
+
+def document(_id, name, curation_date='2021-03-01', **fields):
+    return {'_id': _id, 'name': name, 'curatedBy': {'name': 'Harvard Dataverse', 'curationDate': curation_date}, **fields}
+
+class TestFingerprintIndex(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'fingerprints.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_fingerprint_ignores_key_order_and_volatile_fields(self):
+        first  = document('dataverse1', 'one', author=[{'name': 'A', 'affiliation': 'B'}])
+        second = {'author': [{'affiliation': 'B', 'name': 'A'}], **document('dataverse1', 'one', curation_date='2021-03-02')}
+        self.assertEqual(fingerprint(first), fingerprint(second))
+        self.assertNotEqual(fingerprint(first), fingerprint({**first, 'name': 'two'}))
+        self.assertEqual(first['curatedBy']['curationDate'], '2021-03-01')
+
+    def test_only_the_delta_passes_through(self):
+        index = FingerprintIndex(self.path)
+        first = [document('dataverse1', 'one'), document('dataverse2', 'two'), document('dataverse3', 'three')]
+        self.assertEqual(list(index.delta(first)), first)
+        index.commit()
+        index.close()
+
+        index = FingerprintIndex(self.path)
+        second = [document('dataverse1', 'one', curation_date='2021-03-02'),
+                  document('dataverse2', 'two, revised'), document('dataverse4', 'four')]
+        self.assertEqual(list(index.delta(second)), second[1:] + [{'_id': 'dataverse3', '_deleted': True}])
+        self.assertEqual((index.inserted, index.modified, index.unchanged), (1, 1, 1))
+        index.close()
+
+        # never committed, so the same delta comes out again
+        index = FingerprintIndex(self.path)
+        self.assertEqual(len(list(index.delta(second))), 3)
+        index.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import os
+import json
+import shutil
+import logging
+import tempfile
+import unittest
+
+from outbreak_parser_tools.logger import Metrics
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_summary(self):
+        metrics = Metrics(interval=3600)
+        with metrics.timer('fetch'):
+            metrics.count('http_requests')
+            metrics.count('bytes', 512)
+
+        @metrics.timed('transform')
+        def transform(i):
+            return i * 2
+
+        @metrics.timed()
+        def load_annotations():
+            for i in range(3):
+                yield transform(i)
+
+        self.assertEqual(list(load_annotations()), [0, 2, 4])
+
+        path = os.path.join(self.directory, 'summary.json')
+        metrics.write_summary(path)
+        with open(path) as infile:
+            summary = json.load(infile)
+        self.assertEqual(summary['counters'], {'http_requests': 1, 'bytes': 512})
+        self.assertEqual(summary['timings']['fetch']['calls'], 1)
+        self.assertEqual(summary['timings']['transform']['calls'], 3)
+        self.assertEqual(summary['timings']['TestMetrics.test_summary.<locals>.load_annotations']['calls'], 4)
+
+    def test_throughput_is_logged(self):
+        metrics = Metrics(interval=0)
+        with self.assertLogs('outbreak_parser_tools.metrics', level=logging.INFO) as logs:
+            metrics.count('docs_in.topic', 10)
+        self.assertIn('docs_in.topic', logs.output[0])
+
+if __name__ == '__main__':
+    unittest.main()
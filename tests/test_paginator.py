@@ -0,0 +1,83 @@
+import json
+import threading
+import unittest
+
+from http.server  import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from outbreak_parser_tools.paginator import IncompleteHarvest, Paginator, compile_paginated_data
+
+class StubSearch(BaseHTTPRequestHandler):
+    """
+    dataverse-like search endpoint over server.items,
+    answering garbage the first time each offset in server.broken is asked for,
+    and 429 the first time each offset in server.throttled is
+    """
+    def do_GET(self):
+        query    = parse_qs(urlparse(self.path).query)
+        start    = int(query['start'][0])
+        per_page = int(query['per_page'][0])
+        with self.server.lock:
+            self.server.requests.append((start, per_page))
+            throttled = start in self.server.throttled
+            self.server.throttled.discard(start)
+            broken = not throttled and start in self.server.broken
+            if broken:
+                self.server.broken.discard(start)
+
+        if throttled:
+            self.send_response(429)
+            self.send_header('Retry-After', '0')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if broken:
+            body = b'<html>proxy error</html>'
+        else:
+            items = self.server.items[start:start + per_page]
+            body  = json.dumps({'status': 'OK', 'data': {'total_count': len(self.server.items), 'items': items}}).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class PaginatorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubSearch)
+        self.server.items    = [{'global_id': f'doi:10.7910/DVN/{i}'} for i in range(1234)]
+        self.server.broken   = set()
+        self.server.throttled = set()
+        self.server.requests = []
+        self.server.lock     = threading.Lock()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.endpoint = f'http://127.0.0.1:{self.server.server_port}/api/search?q=*'
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class TestPaginator(PaginatorTestCase):
+    def test_all_items_in_order(self):
+        items = compile_paginated_data(self.endpoint, per_page=100, concurrency=4)
+        self.assertEqual(items, self.server.items)
+        self.assertEqual(len(self.server.requests), 13)
+
+    def test_failed_page_is_split(self):
+        self.server.broken = {300}
+        items = compile_paginated_data(self.endpoint, per_page=300, concurrency=4)
+        self.assertEqual(items, self.server.items)
+        # the failed page is re-requested as 200 + 100 and later pages use 200
+        self.assertIn((300, 200), self.server.requests)
+        self.assertIn((500, 100), self.server.requests)
+
+    def test_gives_up_after_too_many_failures(self):
+        self.server.broken = {0}
+        paginator = Paginator(self.endpoint, per_page=100, max_retries=0)
+        with self.assertRaises(IncompleteHarvest):
+            list(paginator)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import os
+import time
+import threading
+import unittest
+
+from outbreak_parser_tools.parallel import imap_bounded, fetch_and_transform, transform_records
+
+def transform(schema, gid):
+    if schema.get('broken'):
+        raise ValueError('broken schema')
+    return {'_id': gid, 'name': schema['name'].upper(), 'pid': os.getpid()}
+
+class TestFetchAndTransform(unittest.TestCase):
+    def test_pulls_jobs_lazily(self):
+        pulled = []
+        def jobs():
+            for i in range(100):
+                pulled.append(i)
+                yield i
+
+        results = imap_bounded(lambda i: i * 2, jobs(), max_workers=2, max_pending=4)
+        first = next(results)
+        self.assertLessEqual(len(pulled), 5)
+        self.assertEqual(sorted([first] + list(results)), [i * 2 for i in range(100)])
+
+    def test_fallback_and_transform(self):
+        exports = {'doi:1': {'name': 'one'}, 'doi:2': None, 'doi:3': None, 'doi:4': 'broken'}
+        running = set()
+        overlap = []
+        lock = threading.Lock()
+
+        def fetch(gid, url):
+            with lock:
+                running.add(gid)
+                overlap.append(len(running))
+            time.sleep(0.01)
+            with lock:
+                running.discard(gid)
+            return exports[gid]
+
+        def fallback(gid, url):
+            return {'name': 'scraped'} if gid == 'doi:2' else None
+
+        def transform(schema, gid):
+            return {'_id': gid, 'name': schema['name']}
+
+        results = dict(fetch_and_transform(((gid, f'https://example.org/{gid}') for gid in exports),
+                                           fetch=fetch, transform=transform, fallback=fallback, max_workers=4))
+        self.assertEqual(results, {'doi:1': {'_id': 'doi:1', 'name': 'one'},
+                                   'doi:2': {'_id': 'doi:2', 'name': 'scraped'}})
+        self.assertGreater(max(overlap), 1)
+
+    def test_ordered(self):
+        def slow_for_small(i):
+            time.sleep(0.002 * (10 - i % 10))
+            return i
+        self.assertEqual(list(imap_bounded(slow_for_small, range(50), max_workers=4, ordered=True)), list(range(50)))
+
+class TestTransformRecords(unittest.TestCase):
+    def records(self):
+        for i in range(1000):
+            yield f'doi:{i}', {'name': f'dataset {i}', 'broken': i % 100 == 7}
+
+    def test_ordered_across_processes(self):
+        results = list(transform_records(self.records(), transform, processes=2, chunk_size=64, ordered=True))
+        self.assertEqual([gid for gid, _ in results], [f'doi:{i}' for i in range(1000) if i % 100 != 7])
+        self.assertEqual(results[0][1]['name'], 'DATASET 0')
+        self.assertNotIn(os.getpid(), {r['pid'] for _, r in results})
+
+    def test_unordered_gives_everything(self):
+        results = dict(transform_records(self.records(), transform, processes=2, chunk_size=100))
+        self.assertEqual(len(results), 990)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import shutil
+import tempfile
+import threading
+import unittest
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from outbreak_parser_tools.http_cache   import ResponseCache
+from outbreak_parser_tools.safe_request import SessionManager, retry_policy
+
+class StubExport(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.connections.add(self.client_address)
+        etag = f'"{self.server.version}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.server.statuses.append(304)
+            self.send_response(304)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        self.server.statuses.append(200)
+        body = f'{self.path} v{self.server.version}'.encode()
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class StubServerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubExport)
+        self.server.connections = set()
+        self.server.statuses = []
+        self.server.version  = 1
+        self.server.lock = threading.Lock()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base = f'http://127.0.0.1:{self.server.server_port}'
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class TestSessionManager(StubServerTestCase):
+    def test_get_many_reuses_connections(self):
+        manager = SessionManager(host_pool_sizes={f'127.0.0.1:{self.server.server_port}': 4})
+        urls = [f'{self.base}/export/{i}' for i in range(50)]
+        responses = manager.get_many(urls, max_workers=4)
+        self.assertEqual([r.text for r in responses], [f'/export/{i} v1' for i in range(50)])
+        self.assertLessEqual(len(self.server.connections), 4)
+
+        manager.get(f'{self.base}/again')
+        self.assertLessEqual(len(self.server.connections), 4)
+        manager.close()
+
+    def test_failures_are_none(self):
+        manager = SessionManager(retries=0)
+        responses = manager.get_many([f'{self.base}/ok', 'http://127.0.0.1:1/refused'])
+        self.assertEqual(responses[0].text, '/ok v1')
+        self.assertIsNone(responses[1])
+        manager.close()
+
+    def test_retry_after_left_to_the_caller(self):
+        self.assertTrue(retry_policy().is_retry('GET', 503, has_retry_after=True))
+        paced = retry_policy(status_forcelist=(429, 500, 503), retry_after=False)
+        self.assertFalse(paced.is_retry('GET', 503, has_retry_after=True))
+        self.assertFalse(paced.is_retry('GET', 429, has_retry_after=True))
+        self.assertTrue(paced.is_retry('GET', 500))
+
+class TestResponseCache(StubServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self.directory)
+
+    def test_revalidates_with_etag(self):
+        manager = SessionManager(cache=ResponseCache(self.directory))
+        url = f'{self.base}/export/1'
+        self.assertEqual(manager.get(url).text, '/export/1 v1')
+        cached = manager.get(url)
+        self.assertEqual(cached.text, '/export/1 v1')
+        self.assertTrue(cached.from_cache)
+        self.assertEqual(self.server.statuses, [200, 304])
+
+        self.server.version = 2
+        self.assertEqual(manager.get(url).text, '/export/1 v2')
+        self.assertEqual(self.server.statuses, [200, 304, 200])
+        manager.close()
+
+    def test_ttl_skips_the_network(self):
+        manager = SessionManager(cache=ResponseCache(self.directory, ttl=60))
+        url = f'{self.base}/export/1'
+        manager.get(url)
+        manager.get(url)
+        self.assertEqual(self.server.statuses, [200])
+        manager.close()
+
+    def test_least_recently_used_evicted(self):
+        cache = ResponseCache(self.directory, ttl=60, max_bytes=10)
+        manager = SessionManager(cache=cache)
+        for path in ('/a', '/b', '/a', '/c'):
+            manager.get(f'{self.base}{path}')
+        self.assertIsNotNone(cache.lookup(f'{self.base}/a'))
+        self.assertIsNone(cache.lookup(f'{self.base}/b'))
+        self.assertIsNotNone(cache.lookup(f'{self.base}/c'))
+        manager.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from unittest.mock import patch
+
+from outbreak_parser_tools import addendum, serialization
+
+RECORDS = [
+    {"_id": "199059", "topicCategory": "['Mechanism', 'Treatment']", "name": "Ünïcødé ☃"},
+    {"_id": "2020.01.20.913368", "topicCategory": "['Mechanism', 'Transmission', 'Treatment']"},
+]
+
+class TestSerialization(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def test_round_trips(self):
+        for engine in (serialization.orjson, None):
+            with patch.object(serialization, 'orjson', engine):
+                self.assertEqual(serialization.write_ndjson(iter(RECORDS), self.path('records.ndjson')), 2)
+                self.assertEqual(serialization.write_json_array(iter(RECORDS), self.path('records.json')), 2)
+                self.assertFalse(serialization.is_json_array(self.path('records.ndjson')))
+                self.assertTrue(serialization.is_json_array(self.path('records.json')))
+                for name in ('records.ndjson', 'records.json'):
+                    self.assertEqual(list(serialization.iter_records(self.path(name))), RECORDS)
+                    self.assertEqual(serialization.read_records(self.path(name)), RECORDS)
+
+    def test_offsets_point_at_records(self):
+        serialization.write_ndjson(RECORDS, self.path('records.ndjson'))
+        with open(self.path('records.ndjson'), 'rb') as infile:
+            raw = infile.read()
+        for offset, length, record in serialization.iter_offsets(self.path('records.ndjson')):
+            self.assertEqual(serialization.loads(raw[offset:offset + length]), record)
+
+    def test_ndjson_annotations(self):
+        serialization.write_ndjson(RECORDS, self.path('topics.ndjson'))
+        for backend in ('memory', 'index', 'snapshot'):
+            documents = [{"_id": "199059"}, {"_id": "other"}]
+            addendum.Topic(self.path('topics.ndjson'), backend=backend).update(documents)
+            self.assertEqual(documents, [{"_id": "199059", "topicCategory": ['Mechanism', 'Treatment']}, {"_id": "other"}])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import unittest
+
+from types import SimpleNamespace
+
+from outbreak_parser_tools              import safe_request
+from outbreak_parser_tools.paginator    import IncompleteHarvest, Paginator
+from outbreak_parser_tools.safe_request import POOL_MAXSIZE
+from outbreak_parser_tools.throttle     import AdaptiveController
+
+from test_paginator import PaginatorTestCase
+
+def http_error(status, headers=None):
+    error = Exception(f'{status} error')
+    error.response = SimpleNamespace(status_code=status, headers=headers or {})
+    return error
+
+class TestAdaptiveController(unittest.TestCase):
+    def test_grows_after_each_successful_round(self):
+        controller = AdaptiveController(per_page=100, concurrency=2, page_step=100, max_concurrency=3)
+        controller.success(0.1)
+        self.assertEqual((controller.per_page, controller.concurrency), (100, 2))
+        controller.success(0.1)
+        self.assertEqual((controller.per_page, controller.concurrency), (200, 3))
+        for _ in range(3):
+            controller.success(0.1)
+        self.assertEqual((controller.per_page, controller.concurrency), (300, 3))
+
+    def test_throttling_halves_concurrency_and_pauses(self):
+        controller = AdaptiveController(per_page=400, concurrency=8)
+        self.assertTrue(controller.failure(http_error(429, {'Retry-After': '5'})))
+        self.assertEqual((controller.per_page, controller.concurrency), (400, 4))
+        self.assertGreater(controller.delay(), 4)
+
+        controller = AdaptiveController(backoff=1)
+        controller.failure(http_error(503))
+        controller.failure(http_error(503))
+        self.assertGreater(controller.delay(), 1)
+
+    def test_other_failures_shrink_pages(self):
+        controller = AdaptiveController(per_page=400, concurrency=8, min_per_page=150)
+        self.assertFalse(controller.failure(ValueError('not json')))
+        self.assertEqual(controller.per_page, 200)
+        self.assertEqual(controller.concurrency, 4)  # one failure in one request is over max_error_rate
+        controller.failure(http_error(500))
+        self.assertEqual(controller.per_page, 150)
+        self.assertEqual(controller.delay(), 0)
+
+    def test_slow_responses_count_as_congestion(self):
+        controller = AdaptiveController(concurrency=8, target_latency=1.0)
+        controller.success(2.5)
+        self.assertEqual(controller.concurrency, 4)
+
+        controller = AdaptiveController(concurrency=8)
+        for _ in range(10):
+            controller.success(0.1)
+        controller.success(1.0)
+        self.assertLess(controller.concurrency, 8)
+
+class TestControlledPaginator(PaginatorTestCase):
+    def test_throttled_and_failed_pages(self):
+        # the first page is throttled, then garbled, then served in two halves
+        self.server.throttled = {0}
+        self.server.broken    = {0}
+        controller = AdaptiveController(per_page=100, concurrency=2, page_step=50)
+        paginator  = Paginator(self.endpoint, controller=controller, max_retries=1)
+        self.assertEqual(list(paginator), self.server.items)
+
+        # the throttled page is asked for again as it was, without using up the retry
+        self.assertEqual(self.server.requests[:3], [(0, 100), (0, 100), (0, 50)])
+        # both failures reached the controller, the 429 wasn't retried by urllib3
+        self.assertEqual(list(controller.outcomes)[:2], [False, False])
+        self.assertEqual(paginator.retries, 1)
+        self.assertGreater(max(size for _, size in self.server.requests), 100)
+
+    def test_always_throttled_gives_up(self):
+        requests = []
+        def fetch(url):
+            requests.append(url)
+            raise http_error(503, {'Retry-After': '0'})
+
+        controller = AdaptiveController(per_page=100, min_per_page=100)
+        paginator  = Paginator(self.endpoint, controller=controller, fetch=fetch, max_retries=1, max_throttles=3)
+        with self.assertRaises(IncompleteHarvest):
+            list(paginator)
+        # 4 throttles, then one retry that is throttled 4 more times
+        self.assertEqual(len(requests), 8)
+
+    def test_concurrency_capped_at_pool(self):
+        self.assertEqual(AdaptiveController().max_concurrency, POOL_MAXSIZE)
+        controller = AdaptiveController(concurrency=32, max_concurrency=32)
+        paginator  = Paginator(self.endpoint, controller=controller)
+        self.assertEqual(paginator.workers, safe_request.session_manager().pool_size(self.endpoint))
+        self.assertEqual(paginator.page_limit(), paginator.workers)
+        self.assertEqual(Paginator(self.endpoint, controller=controller, fetch=list).workers, 32)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+import os
+import sys
+import json
+import shutil
+import types
+import tempfile
+import threading
+import unittest
+
+from http.server   import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+from outbreak_parser_tools import upload_config
+
+MAPPING = {'name': {'type': 'text'}, 'topicCategory': {'type': 'keyword'}}
+
+class MissingMapping(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_response(404)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+class BaseSourceUploader:
+    """
+    stands in for biothings' uploader: load() only remembers its arguments
+    and drains load_data
+    """
+    def load(self, *args, **kwargs):
+        self.load_args   = args
+        self.load_kwargs = kwargs
+        self.documents   = list(self.load_data('data_folder'))
+
+class BasicStorage:
+    pass
+
+def stub_biothings():
+    modules = {name: types.ModuleType(name) for name in (
+        'biothings', 'biothings.hub', 'biothings.hub.dataload',
+        'biothings.hub.dataload.uploader', 'biothings.hub.dataload.storage')}
+    modules['biothings.hub.dataload.uploader'].BaseSourceUploader = BaseSourceUploader
+    modules['biothings.hub.dataload.storage'].BasicStorage        = BasicStorage
+    for name, module in modules.items():
+        parent, _, child = name.rpartition('.')
+        if parent:
+            setattr(modules[parent], child, module)
+    return patch.dict(sys.modules, modules)
+
+class RecordingAnnotator:
+    def __init__(self):
+        self.batches = []
+
+    def update(self, documents):
+        self.batches.append([document['_id'] for document in documents])
+        for document in documents:
+            document['annotated'] = True
+
+class TestUploadConfig(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache_file = os.path.join(self.directory, 'mapping.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_import_does_not_need_biothings(self):
+        self.assertTrue(hasattr(upload_config, 'create_uploader'))
+        if 'biothings' in sys.modules:
+            self.skipTest('biothings already imported by something else')
+        self.assertNotIn('biothings.hub.dataload.uploader', sys.modules)
+
+    def test_fresh_cache_skips_fetch(self):
+        with open(self.cache_file, 'w') as outfile:
+            json.dump({'name': {'type': 'text'}}, outfile)
+        mapping = upload_config.fetch_mapping('http://127.0.0.1:9/unreachable', self.cache_file)
+        self.assertEqual(mapping, {'name': {'type': 'text'}})
+
+    def test_stale_cache_used_when_fetch_fails(self):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), MissingMapping)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        with open(self.cache_file, 'w') as outfile:
+            json.dump(MAPPING, outfile)
+        os.utime(self.cache_file, (0, 0))
+        try:
+            mapping = upload_config.fetch_mapping(f'http://127.0.0.1:{server.server_port}/mapping.json', self.cache_file, ttl=60)
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual(mapping, MAPPING)
+
+class TestCreateUploader(unittest.TestCase):
+    def setUp(self):
+        self.directory  = tempfile.mkdtemp()
+        self.cache_file = os.path.join(self.directory, 'mapping.json')
+        with open(self.cache_file, 'w') as outfile:
+            json.dump(MAPPING, outfile)
+        self.config = {
+            'name':      'litcovid',
+            'map':       'http://127.0.0.1:9/unreachable',
+            'map_cache': self.cache_file,
+            'vars':      ['name'],
+            'metadata':  {'src_meta': {}},
+        }
+        self.stubs = stub_biothings()
+        self.stubs.start()
+
+    def tearDown(self):
+        self.stubs.stop()
+        shutil.rmtree(self.directory)
+
+    def parser(self):
+        self.parsed = []
+        for i in range(7):
+            self.parsed.append(i)
+            yield {'_id': str(i)}
+
+    def test_uploader_class(self):
+        uploader = upload_config.create_uploader(self.config, self.parser)
+        self.assertEqual(uploader.__name__, 'LitcovidUploader')
+        self.assertTrue(issubclass(uploader, BaseSourceUploader))
+        self.assertIs(uploader.storage_class, BasicStorage)
+        self.assertEqual(uploader.get_mapping(), {'name': {'type': 'text'}})
+
+    def test_load_data_is_batched(self):
+        uploader = upload_config.create_uploader(self.config, self.parser, batch_size=3)()
+        documents = uploader.load_data('data_folder')
+        self.assertEqual(next(documents), {'_id': '0'})
+        self.assertEqual(self.parsed, [0, 1, 2])
+        self.assertEqual([document['_id'] for document in documents], [str(i) for i in range(1, 7)])
+
+    def test_annotator_made_once_and_applied_per_batch(self):
+        annotators = []
+        def factory():
+            annotators.append(RecordingAnnotator())
+            return annotators[-1]
+
+        uploader = upload_config.create_uploader(self.config, self.parser, annotator=factory, batch_size=3)()
+        uploader.load()
+        self.assertEqual(len(annotators), 1)
+        self.assertEqual(annotators[0].batches, [['0', '1', '2'], ['3', '4', '5'], ['6']])
+        self.assertTrue(all(document['annotated'] for document in uploader.documents))
+
+        uploader.load()
+        self.assertEqual(len(annotators), 2)
+
+    def test_load_passes_batch_size(self):
+        uploader = upload_config.create_uploader(self.config, self.parser, batch_size=3)()
+        uploader.load()
+        self.assertEqual(uploader.load_kwargs, {'batch_size': 3})
+        uploader.load(batch_size=5)
+        self.assertEqual(uploader.load_kwargs, {'batch_size': 5})
+        uploader.load(None, False, 8)
+        self.assertEqual((uploader.load_args, uploader.load_kwargs), ((None, False, 8), {}))
+
+if __name__ == '__main__':
+    unittest.main()